@@ -0,0 +1,266 @@
+#batch_extraction.py
+# Batch-job mode for large backfills: prompts go out as one keyed JSONL job
+# instead of per-report calls. The job directory keeps the results and any
+# in-flight job id so an interrupted run resumes without resending keys.
+import json
+import os
+import time
+from text_analysis import _fast_path, build_prompt, parse_findings, failed_findings
+from data_storage import store_data_sql, stored_keys
+from utils import canonical_ts
+from llm_backends import backend_config, load_env
+
+REQUESTS_FILE = "requests.jsonl"
+RESULTS_FILE = "results.jsonl"
+JOB_FILE = "job.json"
+
+
+def request_key(empi_id, timestamp):
+    return f"{empi_id}|{timestamp}"
+
+
+def split_key(key):
+    empi_id, _, timestamp = key.rpartition("|")
+    return empi_id, timestamp
+
+
+def read_jsonl(path):
+    if not os.path.exists(path):
+        return []
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rows.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A partially written last line from an interrupted run
+                print(f"Skipping malformed line in {path}")
+    return rows
+
+
+def _drop_partial_line(path):
+    """
+    Truncate path back to its last complete line, removing what an
+    interrupted append left behind.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        end = pos = f.seek(0, os.SEEK_END)
+        while pos > 0:
+            step = min(pos, 64 * 1024)
+            f.seek(pos - step)
+            newline = f.read(step).rfind(b"\n")
+            if newline != -1:
+                pos = pos - step + newline + 1
+                break
+            pos -= step
+        if pos < end:
+            f.truncate(pos)
+
+
+def write_jsonl(rows, path, mode="w"):
+    # Appending after a truncated last line would glue the first new row onto it
+    if mode == "a":
+        _drop_partial_line(path)
+    with open(path, mode, encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+
+def _response_text(result):
+    """
+    Pull the model text out of a batch result line (Gemini batch output format).
+    """
+    response = result.get("response") or {}
+    candidates = response.get("candidates") or []
+    if not candidates:
+        return None
+    parts = candidates[0].get("content", {}).get("parts") or []
+    return "".join(p.get("text", "") for p in parts) or None
+
+
+class LocalBatchExecutor:
+    """
+    Stand-in for the batch endpoint that answers each request with respond_fn(prompt).
+    Used in tests and for small local backfills.
+    """
+
+    def __init__(self, respond_fn):
+        self.respond_fn = respond_fn
+        self._jobs = {}
+
+    def submit(self, requests_path):
+        job_id = f"local-{len(self._jobs) + 1}"
+        results = []
+        for req in read_jsonl(requests_path):
+            prompt = req["request"]["contents"][0]["parts"][0]["text"]
+            try:
+                text = self.respond_fn(prompt)
+                results.append({"key": req["key"], "response": {
+                    "candidates": [{"content": {"parts": [{"text": text}]}}]
+                }})
+            except Exception as e:
+                results.append({"key": req["key"], "error": str(e)})
+        self._jobs[job_id] = results
+        return job_id
+
+    def poll(self, job_id):
+        return "succeeded" if job_id in self._jobs else "failed"
+
+    def fetch(self, job_id):
+        return self._jobs.pop(job_id, [])
+
+
+class GeminiBatchExecutor:
+    """
+    Runs the request file through the Gemini Batch API (google-genai SDK).
+    """
+
+    _DONE_STATES = {
+        "JOB_STATE_SUCCEEDED": "succeeded",
+        "JOB_STATE_FAILED": "failed",
+        "JOB_STATE_CANCELLED": "failed",
+        "JOB_STATE_EXPIRED": "failed",
+    }
+
+    def __init__(self, model=None, api_key=None):
+        from google import genai as genai_client  # only needed for batch jobs
+        load_env()
+        model = model or backend_config("gemini")["model"]
+        self.client = genai_client.Client(api_key=api_key or os.getenv("GEMINI_API_KEY"))
+        self.model = model
+
+    def submit(self, requests_path):
+        uploaded = self.client.files.upload(
+            file=requests_path,
+            config={"display_name": os.path.basename(requests_path), "mime_type": "jsonl"}
+        )
+        job = self.client.batches.create(
+            model=self.model, src=uploaded.name,
+            config={"display_name": f"findings-backfill-{int(time.time())}"}
+        )
+        return job.name
+
+    def poll(self, job_id):
+        job = self.client.batches.get(name=job_id)
+        return self._DONE_STATES.get(job.state.name, "running")
+
+    def fetch(self, job_id):
+        job = self.client.batches.get(name=job_id)
+        content = self.client.files.download(file=job.dest.file_name)
+        return [json.loads(line) for line in content.decode("utf-8").splitlines() if line.strip()]
+
+
+def _load_job(job_dir):
+    path = os.path.join(job_dir, JOB_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_job(job_dir, job):
+    path = os.path.join(job_dir, JOB_FILE)
+    if job is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(job, f)
+
+
+def write_batch_requests(reports_df, requests_path, skip_keys=()):
+    """
+    Write one keyed request per report not in skip_keys.
+    Clear-cut reports are answered by the rule fast path instead and returned
+    as {key: findings}.
+    """
+    skip_keys = set(skip_keys)
+    requests, local = [], {}
+    for row in reports_df.itertuples(index=False):
+        key = request_key(row.empi_id, row.timestamp)
+        if key in skip_keys:
+            continue
+        radiology_text = row.RADIO_REPORT_TEXT
+        clinical_text = getattr(row, "CLINICAL_REPORT_TEXT", "") or ""
+        findings = _fast_path(radiology_text, clinical_text)
+        if findings is not None:
+            local[key] = findings
+            continue
+        requests.append({"key": key, "request": {
+            "contents": [{"role": "user", "parts": [{"text": build_prompt(radiology_text, clinical_text)}]}]
+        }})
+    write_jsonl(requests, requests_path)
+    return len(requests), local
+
+
+def run_batch_extraction(reports_df, job_dir, executor, db_name="findings_db.sqlite",
+                         poll_interval=30, timeout=None):
+    """
+    Extract findings for reports_df (empi_id, timestamp, RADIO_REPORT_TEXT,
+    CLINICAL_REPORT_TEXT) as one batch job and store the results.
+
+    Safe to call again after an interruption: an in-flight job is polled rather
+    than resubmitted, and keys that already have results or stored findings are
+    never resent. Returns the number of findings stored.
+    """
+    os.makedirs(job_dir, exist_ok=True)
+    results_path = os.path.join(job_dir, RESULTS_FILE)
+    requests_path = os.path.join(job_dir, REQUESTS_FILE)
+
+    reports_df = reports_df.copy()
+    reports_df["timestamp"] = canonical_ts(reports_df["timestamp"])
+
+    done = {request_key(e, t) for e, t in stored_keys(db_name)}
+    answered = {r["key"] for r in read_jsonl(results_path)}
+
+    job = _load_job(job_dir)
+    if job is None:
+        pending, local = write_batch_requests(reports_df, requests_path, skip_keys=done | answered)
+        # Fast-path answers are recorded like batch results so they are resumable too
+        write_jsonl([{"key": k, "findings": f} for k, f in local.items()], results_path, mode="a")
+        if pending:
+            job = {"job_id": executor.submit(requests_path), "submitted_at": time.time()}
+            _save_job(job_dir, job)
+            print(f"Submitted batch job {job['job_id']} with {pending} requests")
+
+    if job is not None:
+        started = time.time()
+        state = executor.poll(job["job_id"])
+        while state == "running":
+            if timeout is not None and time.time() - started > timeout:
+                print(f"Batch job {job['job_id']} still running; call again to resume")
+                return 0
+            time.sleep(poll_interval)
+            state = executor.poll(job["job_id"])
+
+        if state == "succeeded":
+            write_jsonl(executor.fetch(job["job_id"]), results_path, mode="a")
+        else:
+            print(f"Batch job {job['job_id']} ended in state {state}; unanswered keys will be resent")
+        _save_job(job_dir, None)
+
+    # Bulk-store every result that isn't in the database yet
+    to_store = {}
+    for result in read_jsonl(results_path):
+        key = result.get("key")
+        if not key or key in done or key in to_store:
+            continue
+        if "findings" in result:
+            findings = result["findings"]
+        else:
+            try:
+                findings = parse_findings(_response_text(result) or "")
+            except Exception as e:
+                print(f"Error parsing batch result for {key}:", result.get("error") or e)
+                findings = failed_findings()
+        empi_id, timestamp = split_key(key)
+        to_store[key] = {"empi_id": empi_id, "timestamp": timestamp, **findings}
+
+    if to_store:
+        store_data_sql(list(to_store.values()), db_name=db_name)
+    return len(to_store)
@@ -0,0 +1,57 @@
+#check_import_time.py
+# Cold-start budget for the modules the dashboard and detail page import.
+# Runs a fresh interpreter with -X importtime and fails if the total import
+# time is over budget or if a heavy SDK is imported eagerly.
+#
+#   python check_import_time.py            (budget from IMPORT_BUDGET_MS)
+import os
+import subprocess
+import sys
+
+APP_MODULES = ["data_retrieval", "text_analysis", "data_storage", "query_builder", "text_store", "utils"]
+# Must only load on first use, never at import
+DEFERRED_MODULES = ["snowflake.connector", "google.generativeai", "plotly.express", "dotenv"]
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", 3000))
+
+
+def profile_imports(modules=APP_MODULES):
+    """
+    {module: cumulative import time in ms} for a fresh interpreter importing modules.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + ", ".join(modules)],
+        cwd=here, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        # "import time:       self [us] |    cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = int(cumulative) / 1000
+    return timings
+
+
+def check(budget_ms=IMPORT_BUDGET_MS):
+    timings = profile_imports()
+    problems = [f"{m} is imported eagerly" for m in DEFERRED_MODULES if m in timings]
+    total = sum(timings.get(m, 0) for m in APP_MODULES)
+    if total > budget_ms:
+        problems.append(f"app imports took {total:.0f} ms (budget {budget_ms:.0f} ms)")
+
+    slowest = sorted(((t, m) for m, t in timings.items() if "." not in m), reverse=True)[:10]
+    print(f"Total app import time: {total:.0f} ms (budget {budget_ms:.0f} ms)")
+    for t, m in slowest:
+        print(f"  {t:8.1f} ms  {m}")
+    return problems
+
+
+if __name__ == "__main__":
+    problems = check()
+    for p in problems:
+        print("FAIL:", p)
+    sys.exit(1 if problems else 0)
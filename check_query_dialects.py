@@ -0,0 +1,105 @@
+#check_query_dialects.py
+# Checks that nearest_clinical_query means the same thing in every dialect.
+# The SQLite dialect is run against an in-memory fixture covering ties,
+# patients without clinical reports and key/patient filters, and compared
+# with a plain-Python reference of the matching rule. The Snowflake SQL can't
+# run here, so it is checked to rank with the same ordering as SQLite.
+#
+#   python check_query_dialects.py
+import re
+import sqlite3
+import sys
+import pandas as pd
+from query_builder import DIALECTS, nearest_clinical_query
+
+RADIO = [
+    ("A", "2024-01-10 09:00:00", "radio A1"),
+    ("A", "2024-03-01 09:00:00", "radio A2"),
+    ("B", "2024-02-01 12:00:00", "radio B1"),   # clinical reports equally far before and after
+    ("C", "2024-02-01 12:00:00", "radio C1"),   # no clinical reports at all
+    ("D", "2024-05-05 08:30:00", "radio D1"),   # clinical report at the exact same time
+]
+CLINICAL = [
+    ("A", "2024-01-01 09:00:00", "clin A early"),
+    ("A", "2024-01-12 09:00:00", "clin A near"),
+    ("A", "2024-02-25 09:00:00", "clin A late"),
+    ("B", "2024-01-31 12:00:00", "clin B before"),
+    ("B", "2024-02-02 12:00:00", "clin B after"),
+    ("D", "2024-05-05 08:30:00", "clin D same"),
+    ("D", "2024-05-06 08:30:00", "clin D next"),
+]
+
+
+def reference(keys=None, empi_ids=None):
+    """
+    {(empi_id, ts): clinical text or None}: nearest clinical report of the same
+    patient, ties going to the earlier one.
+    """
+    expected = {}
+    for empi_id, ts, _ in RADIO:
+        if keys and (empi_id, ts) not in keys:
+            continue
+        if empi_ids and empi_id not in empi_ids:
+            continue
+        candidates = [(abs((pd.Timestamp(c_ts) - pd.Timestamp(ts)).total_seconds()), c_ts, text)
+                      for c_empi, c_ts, text in CLINICAL if c_empi == empi_id]
+        expected[(empi_id, ts)] = min(candidates)[2] if candidates else None
+    return expected
+
+
+def run_sqlite(keys=None, empi_ids=None):
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.execute("CREATE TABLE radio_reports (EMPI_ID TEXT, TIMESTAMP TEXT, RADIO_REPORT_TEXT TEXT)")
+        conn.execute("CREATE TABLE clinical_reports (EMPI_ID TEXT, TIMESTAMP TEXT, CLINICAL_REPORT_TEXT TEXT)")
+        conn.executemany("INSERT INTO radio_reports VALUES (?, ?, ?)", RADIO)
+        conn.executemany("INSERT INTO clinical_reports VALUES (?, ?, ?)", CLINICAL)
+        sql, params = nearest_clinical_query("sqlite", keys=keys, empi_ids=empi_ids)
+        df = pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+    return {(row.EMPI_ID, row.TS): (row.CLINICAL_REPORT_TEXT if pd.notna(row.CLINICAL_REPORT_TEXT) else None)
+            for row in df.itertuples(index=False)}, len(df)
+
+
+def _rank_order(sql, dialect):
+    """
+    The ORDER BY of the ROW_NUMBER window with dialect fragments neutralised.
+    """
+    distance = DIALECTS[dialect]["distance"].format(a="c.TIMESTAMP", b="r.TIMESTAMP")
+    order = re.search(r"ORDER BY (.*?)\) AS rn|ORDER BY (.*?)\) = 1", sql.replace(distance, "<distance>"), re.S)
+    return " ".join((order.group(1) or order.group(2)).split())
+
+
+def check():
+    problems = []
+    cases = {
+        "all reports": {},
+        "by key": {"keys": [("A", "2024-03-01 09:00:00"), ("C", "2024-02-01 12:00:00")]},
+        "by patient": {"empi_ids": ["B", "D"]},
+    }
+    for name, kwargs in cases.items():
+        got, rows = run_sqlite(**kwargs)
+        expected = reference(**kwargs)
+        if rows != len(expected):
+            problems.append(f"{name}: {rows} rows, expected one per radiology report ({len(expected)})")
+        for key, text in expected.items():
+            if got.get(key, "<missing>") != text:
+                problems.append(f"{name}: {key} matched {got.get(key, '<missing>')!r}, expected {text!r}")
+
+    snowflake_sql, snowflake_params = nearest_clinical_query("snowflake", **cases["by key"])
+    sqlite_sql, sqlite_params = nearest_clinical_query("sqlite", **cases["by key"])
+    if snowflake_params != sqlite_params:
+        problems.append("dialects bind different parameters")
+    if _rank_order(snowflake_sql, "snowflake") != _rank_order(sqlite_sql, "sqlite"):
+        problems.append("dialects rank clinical reports differently")
+    return problems
+
+
+if __name__ == "__main__":
+    problems = check()
+    for p in problems:
+        print("FAIL:", p)
+    if not problems:
+        print("nearest_clinical_query: dialects agree")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,65 @@
+#check_retry_failed.py
+# Regression check for retry_failed_extractions: with more failed rows than
+# worker threads and a bulk get_texts_fn, every failed row must be retried
+# and repaired, not only those picked up before the first result comes back.
+#
+#   python check_retry_failed.py
+import os
+import sqlite3
+import sys
+import tempfile
+import pandas as pd
+from data_storage import FAILED_ROWS_SQL, init_db, retry_failed_extractions
+
+FAILED_ROWS = 12
+MAX_WORKERS = 4
+
+
+def _failed_db(path):
+    init_db(path)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            "INSERT INTO findings (empi_id, critical_findings, incidental_findings, mammogram_score, "
+            "follow_up, risk_level, summary, timestamp) VALUES (?, 'None', 'None', 'None', 'None', 'None', NULL, ?)",
+            [(f"P{i:03d}", f"2024-01-{i + 1:02d} 09:00:00") for i in range(FAILED_ROWS)]
+        )
+    conn.close()
+
+
+def _get_texts(keys_df):
+    df = keys_df.copy()
+    df["RADIO_REPORT_TEXT"] = "Screening mammogram. BI-RADS 1."
+    df["CLINICAL_REPORT_TEXT"] = "Routine screening."
+    return df
+
+
+def _extract(radiology_text, clinical_text):
+    return {"critical_findings": "No", "incidental_findings": "No", "mammogram_score": "1",
+            "follow_up": "No", "risk_level": "Low", "summary": "Normal screening."}
+
+
+def check():
+    problems = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "findings.sqlite")
+        _failed_db(db)
+        updated = retry_failed_extractions(_extract, db_name=db, get_texts_fn=_get_texts,
+                                           max_workers=MAX_WORKERS, batch_size=5)
+        conn = sqlite3.connect(db)
+        still_failed = len(pd.read_sql_query(FAILED_ROWS_SQL, conn))
+        conn.close()
+    if updated != FAILED_ROWS:
+        problems.append(f"updated {updated} of {FAILED_ROWS} failed rows")
+    if still_failed:
+        problems.append(f"{still_failed} rows still failed after the retry")
+    return problems
+
+
+if __name__ == "__main__":
+    problems = check()
+    for p in problems:
+        print("FAIL:", p)
+    if not problems:
+        print(f"retry_failed_extractions: all {FAILED_ROWS} failed rows retried with {MAX_WORKERS} workers")
+    sys.exit(1 if problems else 0)
@@ -1,12 +1,12 @@
 #data_retrieval.py
 
-import snowflake.connector
 import pandas as pd
 import streamlit as st  # NEW: Use Streamlit to access secrets
 
-def get_snowflake_data(query):
+def get_snowflake_data(query, params=None):
     """
     Connects to Snowflake and retrieves data using Streamlit secrets.
+    params are bound to %s placeholders in the query.
     """
     user = st.secrets["SNOWFLAKE_USER"]
     password = st.secrets["SNOWFLAKE_PASSWORD"]
@@ -16,6 +16,8 @@ def get_snowflake_data(query):
     schema = st.secrets["SNOWFLAKE_SCHEMA"]
 
     try:
+        import snowflake.connector  # heavy; only loaded once a query actually runs
+
         # Establish connection
         conn = snowflake.connector.connect(
             user=user,
@@ -27,7 +29,7 @@ def get_snowflake_data(query):
         )
 
         # Fetch data
-        df = pd.read_sql(query, conn)
+        df = pd.read_sql(query, conn, params=params)
         conn.close()
 
         return df
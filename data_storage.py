@@ -2,8 +2,92 @@
 import sqlite3
 import pandas as pd
 import os
+import threading
+from text_store import TEXT_SCHEMA, put_texts, get_texts, get_texts_bulk, ensure_dictionary, clear_dictionary_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Initialize database with full schema (now includes summary)
+# Process-wide cache of the findings frame and small query results, shared by
+# every Streamlit session. Writers in this process bump a generation counter;
+# PRAGMA data_version on a long-lived connection catches writes made by other
+# connections or processes. store_data_sql writes through that same connection,
+# whose own commits leave data_version alone, so its appends can be picked up
+# with a delta read of new ids. Anything else forces a full reload.
+_cache_lock = threading.RLock()
+_cache = {}
+_generations = {}  # db path -> {'append': n, 'full': n}
+
+def _db_key(db_name):
+    return os.path.abspath(db_name)
+
+def _bump_generation(db_name, kind):
+    with _cache_lock:
+        gens = _generations.setdefault(_db_key(db_name), {'append': 0, 'full': 0})
+        gens[kind] += 1
+
+def _cache_entry(db_name):
+    key = _db_key(db_name)
+    entry = _cache.get(key)
+    if entry is None:
+        conn = sqlite3.connect(db_name, check_same_thread=False)
+        entry = _cache[key] = {'conn': conn, 'frame': None, 'queries': {}}
+    return entry
+
+def _state(db_name, entry):
+    gens = _generations.get(_db_key(db_name), {'append': 0, 'full': 0})
+    data_version = entry['conn'].execute("PRAGMA data_version").fetchone()[0]
+    return gens['append'], gens['full'], data_version
+
+def findings_version(db_name="findings_db.sqlite"):
+    """
+    Token that changes whenever the findings data changes; use it to key derived caches.
+    """
+    with _cache_lock:
+        return _state(db_name, _cache_entry(db_name))
+
+def invalidate_cache(db_name="findings_db.sqlite"):
+    with _cache_lock:
+        entry = _cache.pop(_db_key(db_name), None)
+        if entry is not None:
+            entry['conn'].close()
+
+def cached_query(sql, params=(), db_name="findings_db.sqlite"):
+    """
+    Run a read-only query, reusing the last result until the database changes.
+    """
+    with _cache_lock:
+        entry = _cache_entry(db_name)
+        state = _state(db_name, entry)
+        hit = entry['queries'].get((sql, tuple(params)))
+        if hit is not None and hit[0] == state:
+            return hit[1]
+        rows = entry['conn'].execute(sql, tuple(params)).fetchall()
+        entry['queries'][(sql, tuple(params))] = (state, rows)
+        return rows
+
+# One row per patient describing their latest exam, kept up to date on every
+# write so the risk worklist is an index range scan, not a pass over history.
+PATIENT_SUMMARY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS patient_summary (
+    empi_id TEXT PRIMARY KEY,
+    latest_timestamp TEXT,
+    latest_finding_id INTEGER,
+    latest_risk_level TEXT,
+    latest_critical TEXT,
+    latest_follow_up TEXT,
+    needs_attention INTEGER NOT NULL DEFAULT 0,
+    exam_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_patient_summary_worklist
+    ON patient_summary (needs_attention, latest_timestamp DESC);
+CREATE INDEX IF NOT EXISTS idx_patient_summary_latest_finding
+    ON patient_summary (latest_finding_id);
+"""
+
+def _needs_attention(risk_level, follow_up):
+    return int((risk_level or "").strip().lower() == "high" or (follow_up or "").strip().lower() == "yes")
+
+# Initialize database with full schema. Summaries and cached report text live
+# compressed in finding_texts; findings.summary is only kept for older databases.
 def init_db(db_name="findings_db.sqlite"):
     conn = sqlite3.connect(db_name)
     cursor = conn.cursor()
@@ -17,9 +101,17 @@ def init_db(db_name="findings_db.sqlite"):
         follow_up TEXT,
         risk_level TEXT,
         summary TEXT,
-        timestamp TEXT
+        timestamp TEXT,
+        extraction_method TEXT
     )
     """)
+    # 'rules' (fast path) or 'llm'; NULL for rows stored before it was recorded
+    if 'extraction_method' not in {row[1] for row in cursor.execute("PRAGMA table_info(findings)")}:
+        cursor.execute("ALTER TABLE findings ADD COLUMN extraction_method TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_findings_timestamp ON findings (timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_findings_empi_ts ON findings (empi_id, timestamp)")
+    cursor.executescript(PATIENT_SUMMARY_SCHEMA)
+    cursor.executescript(TEXT_SCHEMA)
     conn.commit()
     conn.close()
 
@@ -34,8 +126,6 @@ def assess_risk(critical: str, incidental: str, follow_up: str) -> str:
 
 # Store findings into the SQLite database
 def store_data_sql(extracted_data, db_name="findings_db.sqlite"):
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
     init_db(db_name)
 
     for data in extracted_data:
@@ -45,119 +135,537 @@ def store_data_sql(extracted_data, db_name="findings_db.sqlite"):
             data['follow_up']
         )
 
-    for data in extracted_data:
-        timestamp = data['timestamp']
-        if isinstance(timestamp, pd.Timestamp):
-            timestamp = timestamp.strftime('%Y-%m-%d %H:%M:%S')
-
-        # Prevent duplicates
-        cursor.execute("""
-        SELECT 1 FROM findings WHERE empi_id = ? AND timestamp = ?
-        """, (data['empi_id'], timestamp))
-
-        if not cursor.fetchone():
-            cursor.execute("""
-            INSERT INTO findings (
-                empi_id, critical_findings, incidental_findings,
-                mammogram_score, follow_up, risk_level, summary, timestamp
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                data['empi_id'],
-                data['critical_findings'],
-                data['incidental_findings'],
-                data['mammogram_score'],
-                data['follow_up'],
-                data['risk_level'],
-                data.get('summary', ''),  # default to empty string if missing
-                timestamp
-            ))
+    # Written through the cache's connection so these appends don't move its
+    # data_version; _load_hot can then tell them from writes made elsewhere
+    with _cache_lock:
+        conn = _cache_entry(db_name)['conn']
+        cursor = conn.cursor()
+        try:
+            for data in extracted_data:
+                timestamp = data['timestamp']
+                if isinstance(timestamp, pd.Timestamp):
+                    timestamp = timestamp.strftime('%Y-%m-%d %H:%M:%S')
 
-    conn.commit()
-    conn.close()
+                # Prevent duplicates
+                cursor.execute("""
+                SELECT 1 FROM findings WHERE empi_id = ? AND timestamp = ?
+                """, (data['empi_id'], timestamp))
 
-# Load findings data from SQLite
-def load_data_sql(db_name="findings_db.sqlite"):
-    conn = sqlite3.connect(db_name)
-    try:
-        df = pd.read_sql_query("""
-        SELECT empi_id, timestamp, critical_findings, incidental_findings,
-               mammogram_score, follow_up, risk_level, summary
-        FROM findings
-        """, conn)
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
+                if not cursor.fetchone():
+                    cursor.execute("""
+                    INSERT INTO findings (
+                        empi_id, critical_findings, incidental_findings,
+                        mammogram_score, follow_up, risk_level, summary, timestamp,
+                        extraction_method
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, (
+                        data['empi_id'],
+                        data['critical_findings'],
+                        data['incidental_findings'],
+                        data['mammogram_score'],
+                        data['follow_up'],
+                        data['risk_level'],
+                        '',  # summary goes to finding_texts below
+                        timestamp,
+                        data.get('extraction_method')
+                    ))
+                    finding_id = cursor.lastrowid
+                    put_texts(conn, finding_id, {
+                        'summary': data.get('summary', ''),  # default to empty string if missing
+                        'radiology': data.get('radiology_text'),
+                        'clinical': data.get('clinical_text')
+                    })
+                    # Count the exam and take over the "latest" fields if it is the newest one
+                    cursor.execute("""
+                    INSERT INTO patient_summary (
+                        empi_id, latest_timestamp, latest_finding_id, latest_risk_level,
+                        latest_critical, latest_follow_up, needs_attention, exam_count
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+                    ON CONFLICT (empi_id) DO UPDATE SET
+                        exam_count = exam_count + 1,
+                        latest_finding_id = CASE WHEN excluded.latest_timestamp >= latest_timestamp
+                                                 THEN excluded.latest_finding_id ELSE latest_finding_id END,
+                        latest_risk_level = CASE WHEN excluded.latest_timestamp >= latest_timestamp
+                                                 THEN excluded.latest_risk_level ELSE latest_risk_level END,
+                        latest_critical = CASE WHEN excluded.latest_timestamp >= latest_timestamp
+                                               THEN excluded.latest_critical ELSE latest_critical END,
+                        latest_follow_up = CASE WHEN excluded.latest_timestamp >= latest_timestamp
+                                                THEN excluded.latest_follow_up ELSE latest_follow_up END,
+                        needs_attention = CASE WHEN excluded.latest_timestamp >= latest_timestamp
+                                               THEN excluded.needs_attention ELSE needs_attention END,
+                        latest_timestamp = MAX(excluded.latest_timestamp, latest_timestamp)
+                    """, (
+                        data['empi_id'], timestamp, finding_id, data['risk_level'],
+                        data['critical_findings'], data['follow_up'],
+                        _needs_attention(data['risk_level'], data['follow_up'])
+                    ))
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        # Later texts compress against a dictionary trained on the first ones
+        ensure_dictionary(conn)
+        _bump_generation(db_name, 'append')
+
+FINDINGS_SQL = """
+    SELECT id, empi_id, timestamp, critical_findings, incidental_findings,
+           mammogram_score, follow_up, risk_level
+    FROM findings
+"""
+
+def _load_hot(db_name):
+    """
+    The hot findings table as a frame with ids, served from the process-wide
+    cache when unchanged. Treat the result as read-only.
+    """
+    with _cache_lock:
+        entry = _cache_entry(db_name)
+        state = _state(db_name, entry)
+        cached = entry['frame']
+
+        if cached is not None and cached['state'] == state:
+            return cached['df']
+        if cached is not None and cached['state'][0] != state[0] and cached['state'][1:] == state[1:]:
+            # Only this process's appends since the last read (no other writer moved
+            # data_version): fetch the new rows
+            new_rows = pd.read_sql_query(FINDINGS_SQL + " WHERE id > ?", entry['conn'],
+                                         params=(cached['max_id'],))
+            new_rows['timestamp'] = pd.to_datetime(new_rows['timestamp'])
+            df = pd.concat([cached['df'], new_rows], ignore_index=True) if not new_rows.empty else cached['df']
+        else:
+            df = pd.read_sql_query(FINDINGS_SQL, entry['conn'])
+            df['timestamp'] = pd.to_datetime(df['timestamp'])
+
+        max_id = int(df['id'].max()) if not df.empty else 0
+        entry['frame'] = {'state': state, 'df': df, 'max_id': max_id}
         return df
+
+# Load findings data from SQLite.
+# Without a date range this is the hot table only (recent findings). With a
+# range, or include_archive=True, the monthly archive partitions overlapping
+# the range are read as well.
+def load_data_sql(db_name="findings_db.sqlite", start=None, end=None, include_archive=False):
+    try:
+        start = pd.Timestamp(start) if start is not None else None
+        end = pd.Timestamp(end) if end is not None else None
+        frames = [_load_hot(db_name)]
+        if include_archive or start is not None or end is not None:
+            frames += [_load_partition(path) for path in _partitions_in_range(db_name, start, end)]
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+        if start is not None:
+            df = df[df['timestamp'] >= start.normalize()]
+        if end is not None:
+            df = df[df['timestamp'] < end.normalize() + pd.Timedelta(days=1)]
+        # Callers add columns to the result, so hand out a copy without the id
+        return df.drop(columns='id').reset_index(drop=True)
     except Exception as e:
         print("Error loading data from DB:", e)
         return pd.DataFrame()
+
+# Hot findings the LLM produced (not the rule fast path), to check the rules against
+def load_llm_findings(db_name="findings_db.sqlite"):
+    init_db(db_name)
+    conn = sqlite3.connect(db_name)
+    try:
+        df = pd.read_sql_query(
+            "SELECT empi_id, timestamp, critical_findings, incidental_findings, mammogram_score, "
+            "follow_up, risk_level, extraction_method FROM findings WHERE extraction_method = 'llm'", conn
+        )
     finally:
         conn.close()
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    return df
+
+# (earliest, latest) exam timestamps, from the timestamp index of each file
+def findings_date_bounds(db_name="findings_db.sqlite", include_archive=False):
+    init_db(db_name)
+    paths = [db_name] + ([path for _, path in archive_partitions(db_name)] if include_archive else [])
+    bounds = [cached_query("SELECT MIN(timestamp), MAX(timestamp) FROM findings", db_name=path)[0] for path in paths]
+    starts = [lo for lo, _ in bounds if lo]
+    ends = [hi for _, hi in bounds if hi]
+    if not starts:
+        return None, None
+    return pd.Timestamp(min(starts)), pd.Timestamp(max(ends))
+
+# Stream findings as dicts (summary included) without loading the table, for exports
+def iter_findings(db_name="findings_db.sqlite", include_archive=True, batch_size=1000):
+    paths = [db_name] + ([path for _, path in archive_partitions(db_name)] if include_archive else [])
+    for path in paths:
+        conn = sqlite3.connect(path)
+        try:
+            cursor = conn.execute(FINDINGS_SQL + " ORDER BY id")
+            columns = [c[0] for c in cursor.description]
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                # One summary lookup per batch, not per finding
+                summaries = get_texts_bulk(conn, 'summary', finding_ids=[row[0] for row in rows])
+                for row in rows:
+                    record = dict(zip(columns, row))
+                    record['summary'] = summaries.get(record['id'], '')
+                    yield record
+        finally:
+            conn.close()
+
+# (empi_id, timestamp) pairs already stored (hot and archived), used to skip work on resume
+def stored_keys(db_name="findings_db.sqlite"):
+    init_db(db_name)
+    keys = set(cached_query("SELECT empi_id, timestamp FROM findings", db_name=db_name))
+    for _, path in archive_partitions(db_name):
+        keys |= set(cached_query("SELECT empi_id, timestamp FROM findings", db_name=path))
+    return keys
+
+# Decompressed texts for one finding, e.g. {'summary': ..., 'radiology': ...}
+def load_finding_texts(empi_id, timestamp, db_name="findings_db.sqlite"):
+    if isinstance(timestamp, pd.Timestamp):
+        timestamp = timestamp.strftime('%Y-%m-%d %H:%M:%S')
+    texts = _load_finding_texts(empi_id, timestamp, db_name)
+    if not texts:
+        # Older exams live in the archive partition for their month
+        path = dict(archive_partitions(db_name)).get(str(timestamp)[:7])
+        if path:
+            texts = _load_finding_texts(empi_id, timestamp, path)
+    return texts
+
+def _load_finding_texts(empi_id, timestamp, db_name):
+    conn = sqlite3.connect(db_name)
+    try:
+        row = conn.execute(
+            "SELECT id, summary FROM findings WHERE empi_id = ? AND timestamp = ?", (empi_id, timestamp)
+        ).fetchone()
+        if row is None:
+            return {}
+        texts = get_texts(conn, row[0])
+        # Rows written before the side table still carry the summary inline
+        if not texts.get('summary') and row[1]:
+            texts['summary'] = row[1]
+        return texts
+    except sqlite3.OperationalError as e:
+        print("Error loading finding texts:", e)
+        return {}
+    finally:
+        conn.close()
+
+# All summaries as a frame (empi_id, timestamp, summary), for exports
+def load_summaries(db_name="findings_db.sqlite", include_archive=False):
+    frames = [_load_summaries(db_name)]
+    if include_archive:
+        frames += [_load_summaries(path) for _, path in archive_partitions(db_name)]
+    return pd.concat(frames, ignore_index=True)
+
+def _load_summaries(db_name):
+    conn = sqlite3.connect(db_name)
+    try:
+        df = pd.read_sql_query("SELECT id, empi_id, timestamp, summary FROM findings", conn)
+        compressed = get_texts_bulk(conn, 'summary')
+        df['summary'] = [compressed.get(fid) or inline or '' for fid, inline in zip(df['id'], df['summary'])]
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+        return df.drop(columns='id')
+    finally:
+        conn.close()
+
+# ------------- Patient risk worklist ------------------
+WORKLIST_SQL = """
+    SELECT empi_id, latest_timestamp, latest_risk_level, latest_critical,
+           latest_follow_up, exam_count
+    FROM patient_summary
+    WHERE needs_attention = 1
+    ORDER BY latest_timestamp DESC
+    LIMIT ? OFFSET ?
+"""
+
+# Patients whose latest exam is High risk or needs follow-up, most recent first
+def load_worklist(db_name="findings_db.sqlite", limit=100, offset=0):
+    init_db(db_name)
+    rows = cached_query(WORKLIST_SQL, (limit, offset), db_name=db_name)
+    df = pd.DataFrame(rows, columns=[
+        'empi_id', 'latest_timestamp', 'latest_risk_level', 'latest_critical', 'latest_follow_up', 'exam_count'
+    ])
+    df['latest_timestamp'] = pd.to_datetime(df['latest_timestamp'])
+    return df
+
+def rebuild_patient_summary(db_name="findings_db.sqlite"):
+    """
+    Recompute patient_summary from scratch (hot and archived findings).
+    Needed once for databases created before the table existed.
+    """
+    init_db(db_name)
+    sql = "SELECT id, empi_id, timestamp, risk_level, critical_findings, follow_up FROM findings"
+    frames = []
+    for path in [db_name] + [path for _, path in archive_partitions(db_name)]:
+        conn = sqlite3.connect(path)
+        try:
+            frames.append(pd.read_sql_query(sql, conn))
+        finally:
+            conn.close()
+    df = pd.concat(frames, ignore_index=True)
+
+    conn = sqlite3.connect(db_name)
+    try:
+        with conn:
+            conn.execute("DELETE FROM patient_summary")
+            if not df.empty:
+                counts = df.groupby('empi_id').size()
+                latest = df.sort_values(['timestamp', 'id']).groupby('empi_id').tail(1)
+                conn.executemany("""
+                    INSERT INTO patient_summary (
+                        empi_id, latest_timestamp, latest_finding_id, latest_risk_level,
+                        latest_critical, latest_follow_up, needs_attention, exam_count
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, [(r.empi_id, r.timestamp, int(r.id), r.risk_level, r.critical_findings, r.follow_up,
+                       _needs_attention(r.risk_level, r.follow_up), int(counts[r.empi_id]))
+                      for r in latest.itertuples(index=False)])
+    finally:
+        conn.close()
+    _bump_generation(db_name, 'full')
+    return len(df['empi_id'].unique()) if not df.empty else 0
+
+# Build the summary for databases that have findings but no summary rows yet
+def ensure_patient_summary(db_name="findings_db.sqlite"):
+    init_db(db_name)
+    conn = sqlite3.connect(db_name)
+    try:
+        has_summary = conn.execute("SELECT 1 FROM patient_summary LIMIT 1").fetchone()
+        has_findings = conn.execute("SELECT 1 FROM findings LIMIT 1").fetchone()
+    finally:
+        conn.close()
+    if has_findings and not has_summary:
+        return rebuild_patient_summary(db_name)
+    return 0
 
 # Optional utility to reset the database during development
 def reset_db(db_name="findings_db.sqlite"):
+    invalidate_cache(db_name)
     if os.path.exists(db_name):
         os.remove(db_name)
+    for _, path in archive_partitions(db_name):
+        invalidate_cache(path)
+        os.remove(path)
+    clear_dictionary_cache()
     init_db(db_name)
 
-# Optional utility to retry the database during development
-def retry_failed_extractions(extract_fn, get_radio_fn, get_clinical_fn, db_name="findings_db.sqlite"):
+# ------------- Time-partitioned archive ------------------
+# Findings older than the hot horizon move into one SQLite file per month
+# (archive/<db>_YYYY_MM.sqlite) with the same schema, texts and dictionaries.
+HOT_HORIZON_DAYS = int(os.getenv("FINDINGS_HOT_DAYS", 365))
+
+def archive_dir(db_name="findings_db.sqlite"):
+    return os.path.join(os.path.dirname(os.path.abspath(db_name)), "archive")
+
+def _partition_path(db_name, month):
+    stem = os.path.splitext(os.path.basename(db_name))[0]
+    return os.path.join(archive_dir(db_name), f"{stem}_{month.replace('-', '_')}.sqlite")
+
+def archive_partitions(db_name="findings_db.sqlite"):
+    """
+    [(month 'YYYY-MM', path)] for every archive partition of db_name, oldest first.
+    """
+    folder = archive_dir(db_name)
+    if not os.path.isdir(folder):
+        return []
+    stem = os.path.splitext(os.path.basename(db_name))[0] + "_"
+    parts = []
+    for name in sorted(os.listdir(folder)):
+        if name.startswith(stem) and name.endswith(".sqlite"):
+            month = name[len(stem):-len(".sqlite")].replace('_', '-')
+            parts.append((month, os.path.join(folder, name)))
+    return parts
+
+def _partitions_in_range(db_name, start, end):
+    start_month = start.strftime('%Y-%m') if start is not None else None
+    end_month = end.strftime('%Y-%m') if end is not None else None
+    return [path for month, path in archive_partitions(db_name)
+            if (start_month is None or month >= start_month) and (end_month is None or month <= end_month)]
+
+# Archived partitions only change when archive_old_findings appends to them
+_partition_cache = {}
+
+def _load_partition(path):
+    mtime = os.path.getmtime(path)
+    with _cache_lock:
+        hit = _partition_cache.get(path)
+        if hit is not None and hit[0] == mtime:
+            return hit[1]
+    conn = sqlite3.connect(path)
+    try:
+        df = pd.read_sql_query(FINDINGS_SQL, conn)
+    finally:
+        conn.close()
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    with _cache_lock:
+        _partition_cache[path] = (mtime, df)
+    return df
+
+def archive_old_findings(horizon_days=HOT_HORIZON_DAYS, db_name="findings_db.sqlite", now=None):
+    """
+    Move findings older than horizon_days into their monthly archive partition,
+    except failed extractions awaiting a retry. Each month moves in one
+    transaction across both files. Returns rows moved.
+    """
+    init_db(db_name)
+    cutoff = (pd.Timestamp(now) if now is not None else pd.Timestamp.now()) - pd.Timedelta(days=horizon_days)
+    cutoff = cutoff.strftime('%Y-%m-%d %H:%M:%S')
+
     conn = sqlite3.connect(db_name)
-    df_failed = pd.read_sql_query("""
-        SELECT id, empi_id, timestamp
-        FROM findings
-        WHERE critical_findings IS NULL
-           OR incidental_findings IS NULL
-           OR follow_up IS NULL
-           OR risk_level IS NULL
-           OR summary IS NULL
-    """, conn)
-
-    if df_failed.empty:
+    moved = 0
+    try:
+        months = [m for (m,) in conn.execute(
+            "SELECT DISTINCT substr(timestamp, 1, 7) FROM findings WHERE timestamp < ? ORDER BY 1", (cutoff,)
+        ).fetchall() if m]
+        if not months:
+            return 0
+        os.makedirs(archive_dir(db_name), exist_ok=True)
+
+        for month in months:
+            path = _partition_path(db_name, month)
+            init_db(path)
+            conn.execute("ATTACH DATABASE ? AS arc", (path,))
+            try:
+                # Failed extractions stay hot so retry_failed_extractions still finds them;
+                # they move on a later run once retried
+                rows = (f"SELECT id FROM main.findings WHERE substr(timestamp, 1, 7) = ? AND timestamp < ? "
+                        f"AND id NOT IN (SELECT id FROM ({FAILED_ROWS_SQL}))")
+                params = (month, cutoff)
+                with conn:
+                    # Take both write locks before reading, so concurrent archivers in other
+                    # processes queue up instead of deadlocking across the two files
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.execute("INSERT OR IGNORE INTO arc.compression_dicts SELECT * FROM main.compression_dicts")
+                    moved += conn.execute(
+                        f"INSERT OR REPLACE INTO arc.findings SELECT * FROM main.findings WHERE id IN ({rows})", params
+                    ).rowcount
+                    conn.execute(
+                        f"INSERT OR REPLACE INTO arc.finding_texts SELECT * FROM main.finding_texts WHERE finding_id IN ({rows})", params
+                    )
+                    conn.execute(f"DELETE FROM main.finding_texts WHERE finding_id IN ({rows})", params)
+                    conn.execute(f"DELETE FROM main.findings WHERE id IN ({rows})", params)
+            finally:
+                conn.execute("DETACH DATABASE arc")
+    finally:
         conn.close()
-        return 0
+    _bump_generation(db_name, 'full')
+    return moved
 
-    count_updated = 0
-    cursor = conn.cursor()
+# Rows whose extraction failed: NULLs, or the 'None' sentinel extract_findings writes on error
+FAILED_ROWS_SQL = """
+    SELECT id, empi_id, timestamp
+    FROM findings
+    WHERE critical_findings IS NULL OR critical_findings = 'None'
+       OR incidental_findings IS NULL OR incidental_findings = 'None'
+       OR follow_up IS NULL OR follow_up = 'None'
+       OR risk_level IS NULL OR risk_level = 'None'
+       OR (summary IS NULL AND NOT EXISTS (
+              SELECT 1 FROM finding_texts t WHERE t.finding_id = findings.id AND t.kind = 'summary'))
+"""
 
-    for _, row in df_failed.iterrows():
-        empi_id = row["empi_id"]
-        timestamp = row["timestamp"]
-
-        # Get radiology report text
-        radio_df = get_radio_fn(empi_id, timestamp)
-        if radio_df.empty:
-            continue
-        radio_text = radio_df.iloc[0]["RADIO_REPORT_TEXT"]
-
-        # Get nearest clinical report text
-        clinical_df = get_clinical_fn(empi_id, timestamp)
-        clinical_text = clinical_df.iloc[0]["CLINICAL_REPORT_TEXT"] if not clinical_df.empty else ""
-
-        # Re-extract findings using Gemini
-        findings = extract_fn(radio_text, clinical_text)
-
-        cursor.execute("""
-            UPDATE findings SET
-                critical_findings = ?,
-                incidental_findings = ?,
-                mammogram_score = ?,
-                follow_up = ?,
-                risk_level = ?,
-                summary = ?
-            WHERE id = ?
-        """, (
-            findings["critical_findings"],
-            findings["incidental_findings"],
-            findings["mammogram_score"],
-            findings["follow_up"],
-            findings["risk_level"],
-            findings["summary"],
-            row["id"]
-        ))
-
-        count_updated += 1
+def _fetch_texts_per_row(get_radio_fn, get_clinical_fn, empi_id, timestamp):
+    radio_df = get_radio_fn(empi_id, timestamp)
+    if radio_df.empty:
+        return None, None
+    clinical_df = get_clinical_fn(empi_id, timestamp)
+    clinical_text = clinical_df.iloc[0]["CLINICAL_REPORT_TEXT"] if not clinical_df.empty else ""
+    return radio_df.iloc[0]["RADIO_REPORT_TEXT"], clinical_text
 
+def _flush_updates(conn, updates, db_name):
+    if not updates:
+        return
+    conn.executemany("""
+        UPDATE findings SET
+            critical_findings = ?,
+            incidental_findings = ?,
+            mammogram_score = ?,
+            follow_up = ?,
+            risk_level = ?,
+            extraction_method = ?,
+            summary = ''
+        WHERE id = ?
+    """, [values for values, _ in updates])
+    # Only matters when the retried finding is the patient's latest exam
+    conn.executemany("""
+        UPDATE patient_summary SET
+            latest_critical = ?,
+            latest_follow_up = ?,
+            latest_risk_level = ?,
+            needs_attention = ?
+        WHERE latest_finding_id = ?
+    """, [(critical, follow_up, risk, _needs_attention(risk, follow_up), finding_id)
+          for critical, _, _, follow_up, risk, _, finding_id in (values for values, _ in updates)])
+    for values, texts in updates:
+        put_texts(conn, values[-1], texts)
     conn.commit()
-    conn.close()
-    return count_updated
+    updates.clear()
+    _bump_generation(db_name, 'full')
+
+# Re-run extraction for every failed record
+def retry_failed_extractions(extract_fn, get_radio_fn=None, get_clinical_fn=None,
+                             db_name="findings_db.sqlite", get_texts_fn=None,
+                             max_workers=4, batch_size=25, progress_fn=None):
+    """
+    get_texts_fn(keys_df) should return a DataFrame with empi_id, timestamp,
+    RADIO_REPORT_TEXT and CLINICAL_REPORT_TEXT for all failed keys in one go;
+    without it the per-row get_radio_fn/get_clinical_fn lookups are used.
+    Extractions run on a pool of max_workers threads and results are written
+    every batch_size rows, so an interruption keeps the work done so far.
+    progress_fn(done, total) is called as rows complete.
+    """
+    init_db(db_name)
+    conn = sqlite3.connect(db_name)
+    try:
+        failed = conn.execute(FAILED_ROWS_SQL).fetchall()
+        if not failed:
+            return 0
 
+        texts = {}
+        if get_texts_fn is not None:
+            keys_df = pd.DataFrame(failed, columns=["id", "empi_id", "timestamp"])
+            texts_df = get_texts_fn(keys_df[["empi_id", "timestamp"]].drop_duplicates())
+            for r in texts_df.itertuples(index=False):
+                texts[(r.empi_id, str(r.timestamp))] = (r.RADIO_REPORT_TEXT, r.CLINICAL_REPORT_TEXT or "")
+
+        def work(empi_id, timestamp):
+            if get_texts_fn is not None:
+                radio_text, clinical_text = texts.get((empi_id, timestamp), (None, None))
+            else:
+                radio_text, clinical_text = _fetch_texts_per_row(get_radio_fn, get_clinical_fn, empi_id, timestamp)
+            if radio_text is None:
+                return None
+            findings = extract_fn(radio_text, clinical_text)
+            return findings, {'summary': findings["summary"], 'radiology': radio_text, 'clinical': clinical_text}
+
+        count_updated, done, updates = 0, 0, []
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(work, empi_id, timestamp): row_id for row_id, empi_id, timestamp in failed}
+            for future in as_completed(futures):
+                done += 1
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Error retrying record {futures[future]}:", e)
+                    result = None
+                if result is not None:
+                    findings, row_texts = result
+                    updates.append(((
+                        findings["critical_findings"],
+                        findings["incidental_findings"],
+                        findings["mammogram_score"],
+                        findings["follow_up"],
+                        findings["risk_level"],
+                        findings.get("extraction_method"),
+                        futures[future]
+                    ), row_texts))
+                    count_updated += 1
+                if len(updates) >= batch_size:
+                    _flush_updates(conn, updates, db_name)
+                if progress_fn is not None:
+                    progress_fn(done, len(failed))
+
+        _flush_updates(conn, updates, db_name)
+        return count_updated
+    finally:
+        conn.close()
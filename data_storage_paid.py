@@ -1,26 +1,149 @@
-# data_storage.py
+# data_storage_paid.py
 
-import boto3
+import gzip
+import io
 import json
-from google.cloud import storage
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Findings are exported as gzip-compressed NDJSON in size-bounded parts, so
+# millions of rows never have to sit in memory at once. Each store keeps one
+# client per process; GCS and S3 uploads are chunked/resumable, and LocalStore
+# writes to a directory for tests.
+
+PART_SIZE_BYTES = int(os.getenv("EXPORT_PART_SIZE_BYTES", 64 * 1024 * 1024))
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024  # must be a multiple of 256KB for GCS
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _client(kind):
+    with _clients_lock:
+        if kind not in _clients:
+            if kind == "gcs":
+                from google.cloud import storage
+                _clients[kind] = storage.Client()
+            elif kind == "s3":
+                import boto3
+                _clients[kind] = boto3.client("s3")
+        return _clients[kind]
+
+
+class GCSStore:
+    def __init__(self, bucket_name):
+        self.bucket = _client("gcs").bucket(bucket_name)
+
+    def put(self, key, fileobj, content_type, content_encoding=None):
+        blob = self.bucket.blob(key, chunk_size=UPLOAD_CHUNK_BYTES)  # chunked, resumable upload
+        if content_encoding:
+            blob.content_encoding = content_encoding
+        blob.upload_from_file(fileobj, content_type=content_type, rewind=True)
+
+
+class S3Store:
+    def __init__(self, bucket_name):
+        from boto3.s3.transfer import TransferConfig
+        self.bucket_name = bucket_name
+        self.client = _client("s3")
+        # Multipart upload in fixed-size chunks for anything above one chunk
+        self.transfer_config = TransferConfig(multipart_threshold=UPLOAD_CHUNK_BYTES,
+                                              multipart_chunksize=UPLOAD_CHUNK_BYTES)
+
+    def put(self, key, fileobj, content_type, content_encoding=None):
+        extra = {"ContentType": content_type}
+        if content_encoding:
+            extra["ContentEncoding"] = content_encoding
+        fileobj.seek(0)
+        self.client.upload_fileobj(fileobj, self.bucket_name, key, ExtraArgs=extra, Config=self.transfer_config)
+
+
+class LocalStore:
+    """
+    Directory-backed stand-in for a bucket, used in tests and local runs.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def put(self, key, fileobj, content_type, content_encoding=None):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fileobj.seek(0)
+        with open(path, "wb") as f:
+            f.write(fileobj.read())
+
+
+def open_store(url):
+    """
+    gs://bucket, s3://bucket or a local directory path.
+    """
+    if url.startswith("gs://"):
+        return GCSStore(url[len("gs://"):])
+    if url.startswith("s3://"):
+        return S3Store(url[len("s3://"):])
+    return LocalStore(url)
+
+
+def export_findings(records, store, prefix, part_size=PART_SIZE_BYTES, max_workers=4):
+    """
+    Stream records (an iterable of dicts) to store as gzip NDJSON parts of
+    roughly part_size compressed bytes, uploading parts concurrently. At most
+    max_workers parts are buffered at once. Writes a manifest.json last and
+    returns it.
+    """
+    prefix = prefix.rstrip("/")
+    slots = threading.BoundedSemaphore(max_workers)
+    parts, futures = [], []
+
+    def upload(key, buffer, rows):
+        try:
+            store.put(key, buffer, "application/x-ndjson", content_encoding="gzip")
+            return {"key": key, "rows": rows, "bytes": buffer.getbuffer().nbytes}
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        def flush(buffer, gz, rows):
+            gz.close()
+            key = f"{prefix}/part-{len(futures):05d}.ndjson.gz"
+            slots.acquire()  # back-pressure: wait for a free upload slot
+            futures.append(pool.submit(upload, key, buffer, rows))
+
+        buffer, rows = io.BytesIO(), 0
+        gz = gzip.GzipFile(fileobj=buffer, mode="wb")
+        for record in records:
+            gz.write((json.dumps(record, default=str) + "\n").encode("utf-8"))
+            rows += 1
+            if buffer.tell() >= part_size:
+                flush(buffer, gz, rows)
+                buffer, rows = io.BytesIO(), 0
+                gz = gzip.GzipFile(fileobj=buffer, mode="wb")
+        if rows:
+            flush(buffer, gz, rows)
+
+        for future in futures:
+            parts.append(future.result())
+
+    manifest = {"prefix": prefix, "parts": parts, "rows": sum(p["rows"] for p in parts)}
+    store.put(f"{prefix}/manifest.json", io.BytesIO(json.dumps(manifest).encode("utf-8")), "application/json")
+    print(f"Exported {manifest['rows']} findings in {len(parts)} parts to {prefix}")
+    return manifest
+
 
 # Function to store data in AWS S3
-#def store_data_s3(data, bucket_name, file_name):
-    #s3 = boto3.client('s3')
-    #try:
-        #s3.put_object(Bucket=bucket_name, Key=file_name, Body=json.dumps(data))
-        #print(f"Data saved to S3 at {file_name}")
-    #except Exception as e:
-        #print(f"Error saving data to S3: {e}")
+def store_data_s3(data, bucket_name, file_name):
+    try:
+        S3Store(bucket_name).put(file_name, io.BytesIO(json.dumps(data).encode("utf-8")), "application/json")
+        print(f"Data saved to S3 at {file_name}")
+    except Exception as e:
+        print(f"Error saving data to S3: {e}")
 
 # Function to store data in Google Cloud Storage
 def store_data_gcs(data, bucket_name, file_name):
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(file_name)
-    
     try:
-        blob.upload_from_string(json.dumps(data), content_type='application/json')
+        GCSStore(bucket_name).put(file_name, io.BytesIO(json.dumps(data).encode("utf-8")), "application/json")
         print(f"Data saved to GCS at {file_name}")
     except Exception as e:
         print(f"Error saving data to GCS: {e}")
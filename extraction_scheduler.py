@@ -0,0 +1,164 @@
+#extraction_scheduler.py
+# Orders pending reports before extraction so suspicious and urgent ones are
+# not stuck behind a backfill of routine screens. Urgent-tagged reports go in a
+# fast lane that is always drained first; everything else is ordered by a cheap
+# local urgency score (BI-RADS / keyword hints, then recency). Queue-wait and
+# end-to-end latency are recorded per report.
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+from rule_extraction import urgency_hints
+
+FAST_LANE, NORMAL_LANE = 0, 1
+LANE_NAMES = {FAST_LANE: "urgent", NORMAL_LANE: "normal"}
+
+# Reports scoring at least this much are treated as likely critical
+CRITICAL_SCORE = 70
+# Time-to-critical-result target, in seconds from submission to stored result
+CRITICAL_TARGET_SECONDS = float(os.getenv("CRITICAL_TARGET_SECONDS", 300))
+
+_BIRADS_WEIGHTS = {6: 100, 5: 90, 4: 70, 0: 40, 3: 20, 2: 0, 1: 0}
+RECENCY_WEIGHT = 10
+RECENCY_HALF_LIFE_DAYS = 30
+
+# Latency records of the most recently finished reports
+LATENCY_LOG = deque(maxlen=5000)
+
+
+def urgency_score(radiology_text, timestamp=None, now=None):
+    """
+    Returns (lane, score). Higher scores are extracted first within a lane.
+    """
+    hints = urgency_hints(radiology_text)
+    score = _BIRADS_WEIGHTS.get(hints['birads'], 0)
+    if hints['critical']:
+        score = max(score, CRITICAL_SCORE) + 10
+
+    # Newer exams first among otherwise equal reports
+    ts = pd.to_datetime(timestamp, errors='coerce') if timestamp is not None else pd.NaT
+    if not pd.isna(ts):
+        now = pd.Timestamp(now) if now is not None else pd.Timestamp.now()
+        age_days = max((now - ts).total_seconds() / 86400, 0)
+        score += RECENCY_WEIGHT * 0.5 ** (age_days / RECENCY_HALF_LIFE_DAYS)
+
+    return (FAST_LANE if hints['urgent'] else NORMAL_LANE), score
+
+
+class ExtractionScheduler:
+    """
+    Priority queue in front of the extraction stage.
+
+    submit() may be called while run() is draining the queue (e.g. an urgent
+    report arriving mid-backfill); at most max_workers items are in flight, so
+    a newly submitted urgent report is picked up as soon as a worker frees up.
+    """
+
+    def __init__(self, max_workers=1):
+        self.max_workers = max_workers
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.records = []
+
+    def __len__(self):
+        with self._lock:
+            return len(self._heap)
+
+    def submit(self, key, item, radiology_text="", timestamp=None, urgent=False):
+        """
+        Queue item under key; urgent=True forces the fast lane.
+        """
+        lane, score = urgency_score(radiology_text, timestamp)
+        if urgent:
+            lane = FAST_LANE
+        entry = {'key': key, 'lane': lane, 'score': score, 'enqueued_at': time.monotonic()}
+        with self._lock:
+            heapq.heappush(self._heap, (lane, -score, next(self._seq), entry, item))
+        return lane, score
+
+    def _pop(self):
+        with self._lock:
+            if not self._heap:
+                return None
+            _, _, _, entry, item = heapq.heappop(self._heap)
+            return entry, item
+
+    def run(self, work_fn, on_result=None):
+        """
+        Drain the queue in priority order, calling work_fn(item) on up to
+        max_workers threads and on_result(key, result, entry) in this thread.
+        End-to-end latency includes on_result, so storing there counts.
+        Returns the latency records of this run.
+        """
+        records = []
+
+        def timed(entry, item):
+            entry['started_at'] = time.monotonic()
+            return work_fn(item)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            inflight = {}
+            while True:
+                while len(inflight) < self.max_workers:
+                    popped = self._pop()
+                    if popped is None:
+                        break
+                    entry, item = popped
+                    inflight[pool.submit(timed, entry, item)] = entry
+                if not inflight:
+                    break
+
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    entry = inflight.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"Extraction failed for {entry['key']}: {e}")
+                        result = None
+                    if on_result is not None and result is not None:
+                        on_result(entry['key'], result, entry)
+                    finished = time.monotonic()
+                    record = {
+                        'key'        : entry['key'],
+                        'lane'       : LANE_NAMES[entry['lane']],
+                        'score'      : entry['score'],
+                        'queue_wait' : entry['started_at'] - entry['enqueued_at'],
+                        'end_to_end' : finished - entry['enqueued_at'],
+                        'ok'         : result is not None
+                    }
+                    records.append(record)
+                    LATENCY_LOG.append(record)
+
+        self.records.extend(records)
+        return records
+
+
+def latency_summary(records=None, target=CRITICAL_TARGET_SECONDS):
+    """
+    p50/p95/max queue-wait and end-to-end seconds per lane, plus how many
+    likely-critical reports missed the time-to-result target.
+    """
+    df = pd.DataFrame(list(LATENCY_LOG) if records is None else records)
+    if df.empty:
+        return {}
+    summary = {}
+    for lane, group in df.groupby('lane'):
+        summary[lane] = {
+            'count': len(group),
+            **{f"{col}_{name}": float(group[col].quantile(q)) if q is not None else float(group[col].max())
+               for col in ('queue_wait', 'end_to_end')
+               for name, q in (('p50', 0.5), ('p95', 0.95), ('max', None))}
+        }
+    critical = df[(df['lane'] == LANE_NAMES[FAST_LANE]) | (df['score'] >= CRITICAL_SCORE)]
+    summary['critical'] = {
+        'count': len(critical),
+        'over_target': int((critical['end_to_end'] > target).sum()),
+        'target_seconds': target
+    }
+    return summary
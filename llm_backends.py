@@ -0,0 +1,175 @@
+#llm_backends.py
+import hashlib
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from rule_extraction import parse_birads
+
+_env_loaded = False
+_gemini_configured = False
+_setup_lock = threading.Lock()
+
+
+def load_env():
+    """
+    Load .env once per process (python-dotenv is only imported here).
+    """
+    global _env_loaded
+    with _setup_lock:
+        if not _env_loaded:
+            from dotenv import load_dotenv
+            load_dotenv()
+            _env_loaded = True
+
+
+def configure_gemini(api_key=None):
+    """
+    Configure the Gemini SDK once per process; later calls are no-ops unless a
+    new api_key is passed.
+    """
+    global _gemini_configured
+    load_env()
+    with _setup_lock:
+        if _gemini_configured and api_key is None:
+            return
+        import google.generativeai as genai
+        genai.configure(api_key=api_key or os.getenv("GEMINI_API_KEY"))
+        _gemini_configured = True
+
+
+def backend_config(name):
+    """
+    Per-backend settings; each can be overridden through the environment.
+    """
+    load_env()
+    if name == "gemini":
+        return {
+            "model": os.getenv("GEMINI_MODEL", "gemini-1.5-flash"),
+            "timeout": float(os.getenv("GEMINI_TIMEOUT", 60)),
+            "max_concurrency": int(os.getenv("GEMINI_CONCURRENCY", 4)),
+        }
+    if name == "stub":
+        return {
+            "model": "stub",
+            "timeout": float(os.getenv("STUB_TIMEOUT", 5)),
+            "max_concurrency": int(os.getenv("STUB_CONCURRENCY", 32)),
+            "latency": float(os.getenv("STUB_LATENCY", 0.0)),
+            "failure_rate": float(os.getenv("STUB_FAILURE_RATE", 0.0)),
+            "seed": int(os.getenv("STUB_SEED", 0)),
+        }
+    return {}
+
+
+class ExtractionBackend(ABC):
+    """
+    Turns a prompt into raw model text. Subclasses implement _generate;
+    generate() caps the number of in-flight calls at max_concurrency.
+    """
+    name = "base"
+
+    def __init__(self, model, timeout=60, max_concurrency=4):
+        self.model = model
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def generate(self, prompt: str) -> str:
+        with self._slots:
+            return self._generate(prompt)
+
+    @abstractmethod
+    def _generate(self, prompt: str) -> str:
+        ...
+
+
+class GeminiBackend(ExtractionBackend):
+    name = "gemini"
+
+    def __init__(self, model="gemini-1.5-flash", timeout=60, max_concurrency=4):
+        super().__init__(model, timeout, max_concurrency)
+        configure_gemini()
+        import google.generativeai as genai
+        # One client per process, reused for every call
+        self._client = genai.GenerativeModel(model)
+
+    def _generate(self, prompt):
+        resp = self._client.generate_content(prompt, request_options={"timeout": self.timeout})
+        return resp.text
+
+
+class StubBackend(ExtractionBackend):
+    """
+    Deterministic local model for load and resilience tests: no network,
+    configurable latency, and failures chosen by a hash of the prompt so the
+    same prompt always succeeds or fails the same way for a given seed.
+    """
+    name = "stub"
+
+    def __init__(self, model="stub", timeout=5, max_concurrency=32,
+                 latency=0.0, failure_rate=0.0, seed=0):
+        super().__init__(model, timeout, max_concurrency)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _roll(self, prompt):
+        digest = hashlib.sha256(f"{self.seed}:{prompt}".encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+    def _generate(self, prompt):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(min(self.latency, self.timeout))
+        if self.latency > self.timeout:
+            raise TimeoutError(f"stub backend exceeded {self.timeout}s timeout")
+        if self._roll(prompt) < self.failure_rate:
+            raise RuntimeError("stub backend injected failure")
+
+        categories = parse_birads(prompt)
+        score = max(categories) if categories else 2
+        critical = "Yes" if score >= 4 else "No"
+        incidental = "Yes" if score in (2, 3) else "No"
+        follow_up = "Yes" if score in (0, 3, 4, 5, 6) else "No"
+        return json.dumps({
+            "Critical Findings": critical,
+            "Incidental Findings": incidental,
+            "Mammogram Score": str(score),
+            "Follow Up Required": follow_up,
+            "Risk Level": "High" if critical == "Yes" else ("Medium" if "Yes" in (incidental, follow_up) else "Low"),
+            "Summary": "Stub summary."
+        })
+
+
+BACKENDS = {
+    "gemini": GeminiBackend,
+    "stub": StubBackend,
+}
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_backend(name=None, **overrides):
+    """
+    Return the process-wide backend instance for name (default EXTRACTION_BACKEND).
+    The backend (and its SDK) is only built on first use.
+    Passing overrides builds a fresh instance with those settings and makes it
+    the shared one.
+    """
+    load_env()
+    name = name or os.getenv("EXTRACTION_BACKEND", "gemini")
+    with _instances_lock:
+        if overrides or name not in _instances:
+            config = {**backend_config(name), **overrides}
+            _instances[name] = BACKENDS[name](**config)
+        return _instances[name]
+
+
+def reset_backends():
+    with _instances_lock:
+        _instances.clear()
@@ -0,0 +1,429 @@
+#load_test.py
+# Multi-user load test for the dashboard and the detail page. Builds a
+# synthetic findings DB (and a synthetic Snowflake source) of the requested
+# size in a scratch directory, then drives streamlit_app.py and
+# pages/patient_detail.py headlessly with Streamlit's AppTest from many
+# concurrent simulated sessions (one process each), replaying filter, paging and "View" actions.
+# Snowflake is answered from the synthetic source and Gemini by the stub
+# backend. Reports p50/p95/p99 rerun latency, peak RSS and SQLite lock waits.
+#
+#   python load_test.py --sessions 30 --rows 20000 --actions 20
+#   python load_test.py --max-p95-ms 1500      (exit 1 when over budget or any rerun errors)
+import argparse
+import functools
+import multiprocessing
+import os
+import random
+import re
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_FILES = ["streamlit_app.py", "pages"]
+
+RADIOLOGY_TEMPLATES = [
+    "Screening mammogram. No suspicious masses or calcifications. BI-RADS 1.",
+    "Scattered fibroglandular densities. Benign calcifications in the {side} breast. BI-RADS 2.",
+    "Focal asymmetry in the {side} breast, short-interval follow-up suggested. BI-RADS 3.",
+    "Irregular mass in the {side} breast with spiculated margins. Biopsy recommended. BI-RADS 5.",
+    "STAT read. Architectural distortion in the {side} breast. BI-RADS 4.",
+]
+CLINICAL_TEMPLATES = [
+    "Patient is a {age}-year-old female presenting for routine screening. No family history of breast cancer.",
+    "{age}-year-old female with a palpable lump noted on self exam. Mother diagnosed with breast cancer at 52.",
+    "{age}-year-old female, prior benign biopsy. On hormone replacement therapy.",
+]
+
+
+# ------------- SQLite lock-wait accounting ------------------
+# Every connection the app opens gets busy timeout 0; statements that hit a
+# lock are retried here instead, so the time spent waiting is measured exactly.
+class LockStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waits = []
+        self.failures = 0
+
+    def record(self, seconds, failed=False):
+        with self.lock:
+            self.waits.append(seconds)
+            self.failures += int(failed)
+
+
+LOCK_STATS = LockStats()
+
+
+def _with_lock_retry(timeout, fn, *args):
+    started = None
+    while True:
+        try:
+            result = fn(*args)
+            if started is not None:
+                LOCK_STATS.record(time.perf_counter() - started)
+            return result
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) and "busy" not in str(e):
+                raise
+            now = time.perf_counter()
+            started = started if started is not None else now
+            if now - started >= timeout:
+                LOCK_STATS.record(now - started, failed=True)
+                raise
+            time.sleep(0.001)
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, *args):
+        return _with_lock_retry(self.connection.lock_timeout, super().execute, *args)
+
+    def executemany(self, *args):
+        return _with_lock_retry(self.connection.lock_timeout, super().executemany, *args)
+
+    def executescript(self, script):
+        return _with_lock_retry(self.connection.lock_timeout, super().executescript, script)
+
+
+class TimedConnection(sqlite3.Connection):
+    def __init__(self, *args, timeout=5.0, **kwargs):
+        super().__init__(*args, timeout=0, **kwargs)
+        self.lock_timeout = timeout
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def executescript(self, script):
+        return _with_lock_retry(self.lock_timeout, super().executescript, script)
+
+    def commit(self):
+        return _with_lock_retry(self.lock_timeout, super().commit)
+
+    def __exit__(self, exc_type, exc, tb):
+        # The built-in context manager commits in C, bypassing commit() above
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+
+def instrument_sqlite():
+    sqlite3.connect = functools.partial(sqlite3.connect, factory=TimedConnection)
+
+
+# ------------- Synthetic data ------------------
+def synthetic_reports(rows, patients, days, seed=0):
+    """
+    DataFrame of radiology/clinical report pairs spread over the last days.
+    """
+    rng = random.Random(seed)
+    now = pd.Timestamp.now().floor("s")
+    records = []
+    for i in range(rows):
+        empi_id = f"P{rng.randrange(patients):06d}"
+        ts = now - pd.Timedelta(seconds=rng.randrange(days * 86400))
+        side = rng.choice(["left", "right"])
+        records.append({
+            "empi_id": empi_id,
+            "timestamp": ts.strftime("%Y-%m-%d %H:%M:%S"),
+            "clinical_timestamp": (ts - pd.Timedelta(days=rng.randrange(1, 30))).strftime("%Y-%m-%d %H:%M:%S"),
+            "radiology_text": rng.choice(RADIOLOGY_TEMPLATES).format(side=side),
+            "clinical_text": rng.choice(CLINICAL_TEMPLATES).format(age=rng.randrange(40, 80)),
+        })
+    return pd.DataFrame(records).drop_duplicates(["empi_id", "timestamp"])
+
+
+def build_source_db(path, reports):
+    """
+    Snowflake stand-in: radio_reports and clinical_reports tables in SQLite.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("CREATE TABLE radio_reports (EMPI_ID TEXT, TIMESTAMP TEXT, RADIO_REPORT_TEXT TEXT)")
+        conn.execute("CREATE TABLE clinical_reports (EMPI_ID TEXT, TIMESTAMP TEXT, CLINICAL_REPORT_TEXT TEXT)")
+        conn.executemany("INSERT INTO radio_reports VALUES (?, ?, ?)",
+                         reports[["empi_id", "timestamp", "radiology_text"]].itertuples(index=False, name=None))
+        conn.executemany("INSERT INTO clinical_reports VALUES (?, ?, ?)",
+                         reports[["empi_id", "clinical_timestamp", "clinical_text"]].itertuples(index=False, name=None))
+        conn.execute("CREATE INDEX idx_radio ON radio_reports (EMPI_ID, TIMESTAMP)")
+        conn.execute("CREATE INDEX idx_clinical ON clinical_reports (EMPI_ID, TIMESTAMP)")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def synthetic_findings(reports, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    for r in reports.itertuples(index=False):
+        critical = "Yes" if "BI-RADS 5" in r.radiology_text or "BI-RADS 4" in r.radiology_text else "No"
+        rows.append({
+            "empi_id": r.empi_id,
+            "timestamp": r.timestamp,
+            "critical_findings": critical,
+            "incidental_findings": rng.choice(["Yes", "No"]),
+            "mammogram_score": re.search(r"BI-RADS (\d)", r.radiology_text).group(1),
+            "follow_up": "Yes" if critical == "Yes" else rng.choice(["Yes", "No", "No"]),
+            "risk_level": "High" if critical == "Yes" else rng.choice(["Low", "Low", "Medium"]),
+            "summary": r.clinical_text,
+            "radiology_text": r.radiology_text,
+            "clinical_text": r.clinical_text,
+        })
+    return rows
+
+
+def stub_snowflake(source_db):
+    """
+    get_snowflake_data replacement answering the dashboard's nearest-clinical
+    queries from the synthetic source. Other queries return no rows.
+    """
+    from query_builder import nearest_clinical_query
+
+    def get_snowflake_data(query, params=None):
+        if "QUALIFY" not in query:
+            return pd.DataFrame()
+        params = list(params or [])
+        n_keys = query.count("r.EMPI_ID = %s AND")
+        keys = list(zip(params[0:2 * n_keys:2], params[1:2 * n_keys:2]))
+        empi_ids = params[2 * n_keys:]
+        sql, sqlite_params = nearest_clinical_query("sqlite", keys=keys or None, empi_ids=empi_ids or None)
+        conn = sqlite3.connect(source_db)
+        try:
+            return pd.read_sql_query(sql, conn, params=sqlite_params)
+        finally:
+            conn.close()
+
+    return get_snowflake_data
+
+
+def prepare_workspace(workdir, rows, patients, days, new_fraction, seed):
+    """
+    Copy the app into workdir and build findings_db.sqlite plus the source DB.
+    Returns the synthetic findings (for picking "View" targets).
+    """
+    for name in APP_FILES:
+        src, dst = os.path.join(HERE, name), os.path.join(workdir, name)
+        if os.path.isdir(src):
+            shutil.copytree(src, dst, ignore=shutil.ignore_patterns("__pycache__"))
+        else:
+            shutil.copy(src, dst)
+
+    reports = synthetic_reports(rows, patients, days, seed)
+    build_source_db(os.path.join(workdir, "source.sqlite"), reports)
+
+    # Leave a fraction unextracted so sessions exercise the stubbed LLM path
+    stored = reports.sample(frac=1 - new_fraction, random_state=seed) if new_fraction else reports
+    findings = synthetic_findings(stored, seed)
+    from data_storage import init_db, store_data_sql
+    db_name = os.path.join(workdir, "findings_db.sqlite")
+    init_db(db_name)
+    store_data_sql(findings, db_name=db_name)
+    return pd.DataFrame(findings)[["empi_id", "timestamp"]]
+
+
+# ------------- Simulated sessions ------------------
+# Each session runs in its own process: AppTest compiles and runs the script
+# in the calling interpreter, and concurrent runs in one process break
+# Streamlit's script compile. Sessions therefore don't share st.cache_resource
+# the way a single server process would, so cross-session caching is not measured.
+def _init_session_process(workdir, env):
+    os.environ.update(env)
+    sys.path.insert(0, HERE)
+    os.chdir(workdir)  # the app opens findings_db.sqlite relative to the working directory
+    import data_retrieval
+    data_retrieval.get_snowflake_data = stub_snowflake(os.path.join(workdir, "source.sqlite"))
+    instrument_sqlite()
+
+
+def timed_run(samples, action, app):
+    started = time.perf_counter()
+    error = None
+    try:
+        app.run()
+        if app.exception:
+            error = app.exception[0].value
+    except Exception as e:
+        error = str(e)
+    samples.append({"action": action, "seconds": time.perf_counter() - started, "error": error})
+    return app
+
+
+def simulate_session(session_id, actions, targets, timeout, seed):
+    """
+    One simulated user. Returns its rerun samples, lock waits and peak RSS.
+    """
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(seed + session_id)
+    samples = []
+    app = AppTest.from_file(os.path.abspath("streamlit_app.py"), default_timeout=timeout)
+    timed_run(samples, "open", app)
+
+    for _ in range(actions):
+        action = rng.choice(["risk", "critical", "followup", "search", "archive", "clear", "view", "view"])
+        try:
+            if action == "risk":
+                app.selectbox[3].set_value(rng.choice(["All", "Low", "Medium", "High"]))
+            elif action == "critical":
+                app.selectbox[1].set_value(rng.choice(["All", "Yes", "No"]))
+            elif action == "followup":
+                app.selectbox[2].set_value(rng.choice(["All", "Yes", "No"]))
+            elif action == "search":
+                app.text_input[0].input(rng.choice(targets)[0][:rng.randrange(2, 8)])
+            elif action == "archive":
+                checkbox = app.checkbox[0]
+                checkbox.set_value(not checkbox.value)
+            elif action == "clear":
+                for box in app.selectbox:
+                    box.set_value("All")
+                app.text_input[0].input("")
+            elif action == "view":
+                # Selecting a table row stores the key in session state and opens the detail page
+                empi_id, timestamp = rng.choice(targets)
+                detail = AppTest.from_file(os.path.abspath(os.path.join("pages", "patient_detail.py")),
+                                           default_timeout=timeout)
+                detail.session_state["selected_patient"] = empi_id
+                detail.session_state["selected_timestamp"] = pd.Timestamp(timestamp)
+                timed_run(samples, "view", detail)
+                continue
+        except (IndexError, KeyError) as e:
+            samples.append({"action": action, "seconds": 0.0, "error": f"widget missing: {e}"})
+            continue
+        timed_run(samples, action, app)
+
+    return {
+        "samples": samples,
+        "lock_waits": LOCK_STATS.waits,
+        "lock_failures": LOCK_STATS.failures,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,  # KB on Linux
+    }
+
+
+def background_writer(stop, db_name, interval, seed):
+    """
+    Keeps appending findings while sessions read, like a running extraction.
+    """
+    from data_storage import store_data_sql
+    i = 0
+    while not stop.wait(interval):
+        reports = synthetic_reports(5, 1000, 1, seed=seed + 10_000 + i)
+        reports["empi_id"] = reports["empi_id"].str.replace("P", "W", regex=False)
+        store_data_sql(synthetic_findings(reports), db_name=db_name)
+        i += 1
+
+
+def percentiles(values):
+    s = pd.Series(values)
+    return {f"p{q}": float(s.quantile(q / 100)) * 1000 for q in (50, 95, 99)}
+
+
+def report(results, elapsed, sessions):
+    df = pd.DataFrame([sample for r in results for sample in r["samples"]])
+    ok = df[df["error"].isna()]
+    error_rate = (len(df) - len(ok)) / len(df) if len(df) else 1.0
+    print(f"\n{len(df)} reruns from {sessions} sessions in {elapsed:.1f}s "
+          f"({len(df) - len(ok)} with errors, {error_rate:.1%})")
+    print(f"{'action':<10}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for action, group in [("all", df)] + list(df.groupby("action")):
+        good = group[group["error"].isna()]
+        p = percentiles(good["seconds"]) if not good.empty else {"p50": 0, "p95": 0, "p99": 0}
+        print(f"{action:<10}{len(group):>7}{len(group) - len(good):>8}"
+              f"{p['p50']:>10.0f}{p['p95']:>10.0f}{p['p99']:>10.0f}")
+
+    session_rss = max((r["peak_rss_kb"] for r in results), default=0) / 1024
+    own_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"\nPeak RSS: {session_rss:.0f} MB per session process, {own_rss:.0f} MB in the writer process")
+
+    waits = LOCK_STATS.waits + [w for r in results for w in r["lock_waits"]]
+    failures = LOCK_STATS.failures + sum(r["lock_failures"] for r in results)
+    if waits:
+        p = percentiles(waits)
+        print(f"SQLite lock waits: {len(waits)} (total {sum(waits) * 1000:.0f} ms, "
+              f"p95 {p['p95']:.0f} ms, max {max(waits) * 1000:.0f} ms, {failures} timed out)")
+    else:
+        print("SQLite lock waits: none")
+
+    for _, row in df[df["error"].notna()].head(5).iterrows():
+        print("ERROR:", row["action"], "-", str(row["error"])[:200])
+    overall = percentiles(ok["seconds"]) if not ok.empty else {}
+    overall["error_rate"] = error_rate
+    return overall
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-user dashboard load test")
+    parser.add_argument("--sessions", type=int, default=30, help="concurrent simulated users")
+    parser.add_argument("--actions", type=int, default=20, help="interactions per session")
+    parser.add_argument("--rows", type=int, default=5000, help="synthetic findings")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=730, help="history spread; older than the hot horizon is archived")
+    parser.add_argument("--new-fraction", type=float, default=0.01, help="reports left for the stubbed LLM")
+    parser.add_argument("--write-interval", type=float, default=1.0, help="seconds between background writes, 0 to disable")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="scratch directory (default: a temp dir, removed afterwards)")
+    parser.add_argument("--max-p95-ms", type=float, help="fail when overall p95 rerun latency exceeds this")
+    parser.add_argument("--max-error-rate", type=float, default=0.0,
+                        help="fail when more than this fraction of reruns errored (default: any error fails)")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="load_test_")
+    os.makedirs(workdir, exist_ok=True)
+    sys.path.insert(0, HERE)
+    os.environ.setdefault("EXTRACTION_BACKEND", "stub")
+
+    try:
+        print(f"Building {args.rows} synthetic reports in {workdir} ...")
+        targets = prepare_workspace(workdir, args.rows, args.patients, args.days, args.new_fraction, args.seed)
+        os.chdir(workdir)
+        instrument_sqlite()
+
+        stop = threading.Event()
+        writer = None
+        if args.write_interval > 0:
+            writer = threading.Thread(target=background_writer, daemon=True,
+                                      args=(stop, "findings_db.sqlite", args.write_interval, args.seed))
+            writer.start()
+
+        targets = list(targets.itertuples(index=False, name=None))
+        env = {"EXTRACTION_BACKEND": os.environ["EXTRACTION_BACKEND"]}
+        started = time.perf_counter()
+        with multiprocessing.get_context("spawn").Pool(
+                args.sessions, initializer=_init_session_process, initargs=(workdir, env)) as pool:
+            results = pool.starmap(simulate_session, [(i, args.actions, targets, args.timeout, args.seed)
+                                                      for i in range(args.sessions)])
+        elapsed = time.perf_counter() - started
+        stop.set()
+        if writer is not None:
+            writer.join()
+
+        overall = report(results, elapsed, args.sessions)
+    finally:
+        os.chdir(HERE)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    failed = False
+    if overall["error_rate"] > args.max_error_rate:
+        print(f"FAIL: {overall['error_rate']:.1%} of reruns errored (allowed {args.max_error_rate:.1%})")
+        failed = True
+    if args.max_p95_ms is not None and overall.get("p95", float("inf")) > args.max_p95_ms:
+        print(f"FAIL: p95 rerun latency {overall.get('p95', float('nan')):.0f} ms over {args.max_p95_ms:.0f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,8 +2,9 @@
 import streamlit as st
 import pandas as pd
 from data_retrieval import get_snowflake_data
-from data_storage import load_data_sql
+from data_storage import load_data_sql, load_finding_texts
 from utils import canonical_ts
+from query_builder import nearest_clinical_query
 import warnings
 
 warnings.filterwarnings('ignore', category=UserWarning,
@@ -57,9 +58,6 @@ if 'selected_patient' not in st.session_state or 'selected_timestamp' not in st.
 patient_id = st.session_state.selected_patient
 selected_timestamp = st.session_state.selected_timestamp
 
-findings_df = load_data_sql()
-# load_data_sql already converts 'timestamp' to pd.to_datetime objects.
-
 # Convert selected_timestamp (which is a single datetime object) to its canonical string form
 # canonical_ts expects a Series, so wrap selected_timestamp
 if not isinstance(selected_timestamp, pd.Timestamp): # Ensure it's a pandas Timestamp for .dt accessor
@@ -70,6 +68,10 @@ if pd.isna(selected_timestamp):
     st.error("Selected timestamp is invalid.")
     st.stop()
 
+# Only the partition covering this exam's date is read (hot table or its archive month)
+findings_df = load_data_sql(start=selected_timestamp, end=selected_timestamp)
+# load_data_sql already converts 'timestamp' to pd.to_datetime objects.
+
 canonical_selected_ts_str_series = canonical_ts(pd.Series([selected_timestamp]))
 
 if canonical_selected_ts_str_series.empty or pd.isna(canonical_selected_ts_str_series.iloc[0]):
@@ -116,42 +118,39 @@ def debug_fetch_rad_rows(patient_id: str, canonical_selected_ts_str: str) -> pd.
 
 
 @st.cache_data(show_spinner=False)
-def debug_fetch_clin_rows(patient_id: str, selected_datetime_obj: pd.Timestamp) -> pd.DataFrame:
-    selected_timestamp_iso_str = selected_datetime_obj.isoformat()
-    # Snowflake's TO_TIMESTAMP_LTZ can be sensitive; ensure the format string matches the isoformat output.
-    # Python's isoformat() by default is 'YYYY-MM-DDTHH:MI:SS.ffffff' or 'YYYY-MM-DDTHH:MI:SS' if microsecond is 0
-    # We might need to adjust the format string for TO_TIMESTAMP_LTZ or pre-format selected_timestamp_iso_str
-    # For simplicity, assuming selected_datetime_obj is naive UTC as per canonical_ts logic,
-    # or Snowflake can handle standard ISO strings.
-    # A safer format for Snowflake might be 'YYYY-MM-DD HH24:MI:SS.FF'
-    # Let's use a specific format for Snowflake's TO_TIMESTAMP_LTZ
-    formatted_ts_for_snowflake = selected_datetime_obj.strftime('%Y-%m-%d %H:%M:%S.%f')
-
-
-    clin_query = f"""
-        SELECT EMPI_ID, CLINICAL_REPORT_TEXT, TIMESTAMP
-        FROM clinical_reports
-        WHERE EMPI_ID = '{patient_id}'
-        ORDER BY ABS(EXTRACT(EPOCH_SECOND FROM TIMESTAMP) - EXTRACT(EPOCH_SECOND FROM TO_TIMESTAMP_LTZ('{formatted_ts_for_snowflake}', 'YYYY-MM-DD HH24:MI:SS.FF6')))
-        LIMIT 1
-    """
-    df = get_snowflake_data(query=clin_query)
-
-    if df is not None and not df.empty and 'TIMESTAMP' in df.columns:
+def debug_fetch_clin_rows(patient_id: str, canonical_selected_ts_str: str) -> pd.DataFrame:
+    # Same set-based nearest-match query the dashboard uses, limited to this exam
+    clin_query, params = nearest_clinical_query("snowflake", keys=[(patient_id, canonical_selected_ts_str)])
+    df = get_snowflake_data(query=clin_query, params=params)
+
+    if df is not None and not df.empty and df['CLINICAL_TIMESTAMP'].notna().any():
+        df = df[df['CLINICAL_TIMESTAMP'].notna()][['EMPI_ID', 'CLINICAL_REPORT_TEXT', 'CLINICAL_TIMESTAMP']]
+        df = df.rename(columns={'CLINICAL_TIMESTAMP': 'TIMESTAMP'})
         dt_series = pd.to_datetime(df['TIMESTAMP'], errors='coerce')
         if dt_series.dt.tz is not None:
             dt_series = dt_series.dt.tz_convert('UTC')
         df['TIMESTAMP_naive'] = dt_series.dt.floor("s").dt.tz_localize(None)
-    elif df is not None: # DataFrame exists but might be empty or missing TIMESTAMP
-        df['TIMESTAMP_naive'] = pd.Series(dtype='datetime64[ns]')
-    else: # df is None
+    else: # no matching exam or no clinical reports for this patient
         df = pd.DataFrame(columns=['EMPI_ID', 'CLINICAL_REPORT_TEXT', 'TIMESTAMP', 'TIMESTAMP_naive'])
-        
+
     return df
 
 
-rad_df = debug_fetch_rad_rows(patient_id, canonical_selected_ts_str)
-clin_df = debug_fetch_clin_rows(patient_id, selected_timestamp) # selected_timestamp is already a pd.Timestamp
+# Summary and any locally cached report text are decompressed only here
+finding_texts = load_finding_texts(patient_id, canonical_selected_ts_str)
+
+if finding_texts.get('radiology'):
+    rad_df = pd.DataFrame({'RADIO_REPORT_TEXT': [finding_texts['radiology']],
+                           'TIMESTAMP_naive': [selected_timestamp.floor('s')]})
+else:
+    rad_df = debug_fetch_rad_rows(patient_id, canonical_selected_ts_str)
+
+if finding_texts.get('clinical'):
+    # The cached copy is the nearest clinical report; its own timestamp isn't kept
+    clin_df = pd.DataFrame({'CLINICAL_REPORT_TEXT': [finding_texts['clinical']],
+                            'TIMESTAMP_naive': [pd.NaT]})
+else:
+    clin_df = debug_fetch_clin_rows(patient_id, canonical_selected_ts_str)
 radiology_text = rad_df.iloc[0]['RADIO_REPORT_TEXT'] if not rad_df.empty else "No radiology reports found."
 
 # ——— Header Banner ———
@@ -203,8 +202,9 @@ with tabs[1]:
         st.markdown("### Original Clinical Report")
         if not clin_df.empty:
             for _, row in clin_df.iterrows():
-                ts = row['TIMESTAMP_naive'].strftime('%Y-%m-%d %H:%M:%S')
-                st.caption(f"Report Timestamp: {ts}")
+                if pd.notna(row['TIMESTAMP_naive']):
+                    ts = row['TIMESTAMP_naive'].strftime('%Y-%m-%d %H:%M:%S')
+                    st.caption(f"Report Timestamp: {ts}")
                 st.markdown(
                     f"<div class='report-text'>{row['CLINICAL_REPORT_TEXT']}</div>", unsafe_allow_html=True)
         else:
@@ -213,7 +213,7 @@ with tabs[1]:
     with col2:
         st.markdown("### Clinical Summary")
         st.markdown(f"""
-        <div class='report-text'>{record.get('summary', 'No summary available.')}
+        <div class='report-text'>{finding_texts.get('summary') or 'No summary available.'}
         </div>
         """, unsafe_allow_html=True)
 
@@ -228,7 +228,7 @@ with tabs[1]:
             "mammogram_score": record["mammogram_score"],
             "follow_up": record["follow_up"],
             "risk_level": record["risk_level"],
-            "summary": record.get("summary", "N/A")
+            "summary": finding_texts.get("summary") or "N/A"
         }
 
         st.json(export_dict, expanded=False)
@@ -0,0 +1,144 @@
+#prompt_compaction.py
+import os
+import re
+
+# Rough budgets in estimated tokens; override through the environment
+RADIOLOGY_TOKEN_BUDGET = int(os.getenv("RADIOLOGY_TOKEN_BUDGET", 800))
+CLINICAL_TOKEN_BUDGET = int(os.getenv("CLINICAL_TOKEN_BUDGET", 600))
+
+# A header is wanted when any of these terms appears in it ("CLINICAL HISTORY" -> history)
+RADIOLOGY_SECTIONS = ("impression", "findings", "bi-rads", "birads", "assessment",
+                      "recommendation", "history", "indication", "reason for exam")
+CLINICAL_SECTIONS = ("history", "hpi", "history of present illness", "past medical history",
+                     "family history", "medications", "assessment", "impression", "plan")
+# Recognised but not wanted. Any other "Word(s):" line, such as "RIGHT BREAST:",
+# is a sub-heading and stays inside the enclosing section.
+OTHER_SECTIONS = ("technique", "comparison", "exam", "examination", "procedure", "allergies",
+                  "review of systems", "vitals", "labs", "addendum")
+KNOWN_SECTIONS = RADIOLOGY_SECTIONS + CLINICAL_SECTIONS + OTHER_SECTIONS
+
+# "IMPRESSION:" / "Family History:" style header candidates at the start of a line
+_HEADER_RE = re.compile(r"^[ \t]*([A-Za-z][A-Za-z /&\-]{1,40}?)[ \t]*:[ \t]*", re.M)
+_BIRADS_RE = re.compile(r"\bBI[\s\-–]?RADS\b", re.I)
+_BOILERPLATE_RE = re.compile(
+    r"^\s*(?:electronically signed|signed by|dictated by|transcribed by|"
+    r"this report (?:was|has been)|page \d+ of \d+|confidential|"
+    r"for questions,? (?:please )?contact|\*+\s*end of report).*$",
+    re.I | re.M
+)
+# Split points after sentence punctuation or a line break; the pieces keep their whitespace
+_CHUNK_RE = re.compile(r"(?<=[.!?])(?=\s)|(?<=\n)")
+_WORD_CHUNK_RE = re.compile(r"\S+\s*")
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text) -> int:
+    """
+    Cheap local token estimate: words and punctuation, with long words
+    counted as several sub-word tokens.
+    """
+    if not text:
+        return 0
+    return sum(1 + len(w) // 8 for w in _WORD_RE.findall(text))
+
+
+def _header_matches(header, terms):
+    return any(re.search(rf"(?<![\w-]){re.escape(term)}(?![\w-])", header) for term in terms)
+
+
+def split_sections(text):
+    """
+    Split a report into (header, body) pairs at known section headers. Text
+    before the first header is returned under the header "".
+    """
+    text = text or ""
+    matches = [m for m in _HEADER_RE.finditer(text)
+               if _header_matches(m.group(1).strip().lower(), KNOWN_SECTIONS)]
+    if not matches:
+        return [("", text.strip())]
+
+    sections = []
+    if text[:matches[0].start()].strip():
+        sections.append(("", text[:matches[0].start()].strip()))
+    for i, m in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        sections.append((m.group(1).strip().lower(), text[m.end():end].strip()))
+    return sections
+
+
+def remove_boilerplate(text) -> str:
+    """
+    Drop signature, disclaimer and paging lines. Report sentences are never
+    dropped, even when repeated ("No suspicious masses." under each breast);
+    repeated section blocks are handled in select_sections.
+    """
+    text = _BOILERPLATE_RE.sub("", text or "")
+    lines = [line.rstrip() for line in text.splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def trim_to_budget(text, budget) -> str:
+    """
+    Keep whole sentences and lines from the start of the text until the token
+    budget is used; the first one that doesn't fit is cut at a word boundary.
+    Line breaks are preserved.
+    """
+    if estimate_tokens(text) <= budget:
+        return text
+    kept, used = [], 0
+    for chunk in _CHUNK_RE.split(text):
+        cost = estimate_tokens(chunk)
+        if used + cost <= budget:
+            kept.append(chunk)
+            used += cost
+            continue
+        # Long unpunctuated paragraphs would otherwise leave the budget unused
+        for word in _WORD_CHUNK_RE.findall(chunk):
+            cost = estimate_tokens(word)
+            if used + cost > budget:
+                break
+            kept.append(word)
+            used += cost
+        break
+    return "".join(kept).rstrip()
+
+
+def select_sections(text, wanted) -> str:
+    sections = split_sections(remove_boilerplate(text))
+    # Unstructured text (no recognised headers) is kept whole
+    if not any(_header_matches(h, wanted) for h, _ in sections):
+        return "\n".join(body for _, body in sections if body)
+
+    seen, parts = set(), []
+    for header, body in sections:
+        # Repeated header blocks (templated copies) are only sent once
+        key = (header, " ".join(body.split()).lower())
+        if not body or key in seen:
+            continue
+        # A BI-RADS category outside a wanted section is still kept
+        if not _header_matches(header, wanted) and not _BIRADS_RE.search(body):
+            continue
+        seen.add(key)
+        parts.append(f"{header.upper()}: {body}" if header else body)
+    return "\n".join(parts)
+
+
+def compact_prompt_inputs(radiology_text, clinical_text,
+                          radiology_budget=RADIOLOGY_TOKEN_BUDGET,
+                          clinical_budget=CLINICAL_TOKEN_BUDGET):
+    """
+    Reduce both reports to their relevant sections within the token budgets.
+    Returns (radiology_text, clinical_text, stats) where stats records the
+    estimated tokens before and after compaction.
+    """
+    radio = trim_to_budget(select_sections(radiology_text, RADIOLOGY_SECTIONS), radiology_budget)
+    clinical = trim_to_budget(select_sections(clinical_text, CLINICAL_SECTIONS), clinical_budget)
+
+    before = estimate_tokens(radiology_text) + estimate_tokens(clinical_text)
+    after = estimate_tokens(radio) + estimate_tokens(clinical)
+    stats = {
+        'tokens_before': before,
+        'tokens_after' : after,
+        'tokens_saved' : max(before - after, 0)
+    }
+    return radio, clinical, stats
@@ -0,0 +1,76 @@
+#query_builder.py
+# Set-based "nearest clinical report" queries. Each radiology report is paired
+# with the clinical report of the same patient closest in time, inside the
+# database, so only the matched pairs are returned.
+
+# Per-dialect fragments: parameter placeholder, canonical timestamp text and
+# absolute distance in seconds between two timestamps
+DIALECTS = {
+    "snowflake": {
+        "param": "%s",
+        "ts_text": "TO_CHAR({col}, 'YYYY-MM-DD HH24:MI:SS')",
+        "distance": "ABS(DATEDIFF('second', {a}, {b}))",
+        "qualify": True,
+    },
+    "sqlite": {
+        "param": "?",
+        "ts_text": "strftime('%Y-%m-%d %H:%M:%S', {col})",
+        "distance": "ABS(strftime('%s', {a}) - strftime('%s', {b}))",
+        "qualify": False,
+    },
+}
+
+
+def nearest_clinical_query(dialect="snowflake", keys=None, empi_ids=None):
+    """
+    Build the nearest-match query for a dialect. Returns (sql, params).
+
+    keys limits the result to specific (empi_id, 'YYYY-MM-DD HH:MM:SS')
+    radiology reports; empi_ids limits it to whole patients. The result has
+    EMPI_ID, TIMESTAMP, TS (canonical timestamp text), RADIO_REPORT_TEXT,
+    CLINICAL_REPORT_TEXT and CLINICAL_TIMESTAMP; clinical columns are NULL
+    when the patient has no clinical report.
+    """
+    d = DIALECTS[dialect]
+    p = d["param"]
+    ts_text = d["ts_text"].format(col="r.TIMESTAMP")
+    distance = d["distance"].format(a="c.TIMESTAMP", b="r.TIMESTAMP")
+
+    where, params = [], []
+    if keys:
+        keys = list(keys)
+        where.append("(" + " OR ".join(f"(r.EMPI_ID = {p} AND {ts_text} = {p})" for _ in keys) + ")")
+        for empi_id, ts in keys:
+            params.extend([str(empi_id), str(ts)])
+    if empi_ids:
+        empi_ids = list(empi_ids)
+        where.append(f"r.EMPI_ID IN ({', '.join([p] * len(empi_ids))})")
+        params.extend(str(e) for e in empi_ids)
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+    # Closest clinical report first; ties go to the earlier report, patients
+    # without clinical reports keep their single NULL-joined row
+    rank = (f"ROW_NUMBER() OVER (PARTITION BY r.EMPI_ID, r.TIMESTAMP "
+            f"ORDER BY CASE WHEN c.TIMESTAMP IS NULL THEN 1 ELSE 0 END, {distance}, c.TIMESTAMP)")
+    columns = (f"r.EMPI_ID, r.TIMESTAMP, {ts_text} AS TS, r.RADIO_REPORT_TEXT, "
+               f"c.CLINICAL_REPORT_TEXT, c.TIMESTAMP AS CLINICAL_TIMESTAMP")
+    join = "FROM radio_reports r LEFT JOIN clinical_reports c ON c.EMPI_ID = r.EMPI_ID"
+
+    if d["qualify"]:
+        sql = f"""
+            SELECT {columns}
+            {join}
+            {where_sql}
+            QUALIFY {rank} = 1
+        """
+    else:
+        sql = f"""
+            SELECT EMPI_ID, TIMESTAMP, TS, RADIO_REPORT_TEXT, CLINICAL_REPORT_TEXT, CLINICAL_TIMESTAMP
+            FROM (
+                SELECT {columns}, {rank} AS rn
+                {join}
+                {where_sql}
+            )
+            WHERE rn = 1
+        """
+    return sql, params
@@ -0,0 +1,201 @@
+#rule_extraction.py
+import re
+from utils import canonical_ts
+
+# Reports at or above this confidence skip the LLM entirely
+RULE_CONFIDENCE_THRESHOLD = 0.9
+
+_BIRADS_RE = re.compile(
+    r"\bBI[\s\-–]?RADS\b(?:\s*(?:category|cat\.?|score|assessment))?\s*[:#\-]?\s*([0-6])(?:[abc])?\b",
+    re.I
+)
+_LATERALITY_RE = re.compile(r"\b(bilateral|left|right)\b", re.I)
+# Phrases like "no suspicious masses" or "negative for malignancy" should not count as
+# positives. Negation covers the next few words only, up to any punctuation, so in
+# "no change in the spiculated mass, which is suspicious" the rest still counts.
+_NEGATED_PHRASE_RE = re.compile(
+    r"\b(?:no|without|negative for|not)\b(?:[ \t]+[^\s.,;:]+){0,4}", re.I
+)
+_CRITICAL_RE = re.compile(
+    r"\b(?:highly suggestive of malignancy|suspicious (?:for|of) malignancy|"
+    r"malignan(?:t|cy)|carcinoma|spiculated|architectural distortion|"
+    r"biopsy (?:is )?(?:recommended|advised)|suspicious (?:mass|lesion|calcifications))\b",
+    re.I
+)
+_INCIDENTAL_RE = re.compile(
+    r"\b(?:benign (?:findings?|calcifications?|appearing)|cyst|fibroadenoma|"
+    r"lymph node|incidental(?:ly)?)\b",
+    re.I
+)
+_NORMAL_IMPRESSION_RE = re.compile(
+    r"\b(?:negative (?:mammogram|study|exam)|no (?:mammographic )?evidence of malignancy|"
+    r"no suspicious (?:masses|findings|calcifications)|normal (?:mammogram|study|exam))\b",
+    re.I
+)
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+# Reports flagged for immediate reading/communication by the ordering side.
+# STAT only counts in capitals; "non-urgent" and negated clauses don't count.
+_URGENT_TAG_RE = re.compile(
+    r"(?<![\w-])(?:STAT|(?i:urgent|emergent|critical result|called to (?:dr\.?|the referring)))\b"
+)
+
+
+def _strip_negated(text: str) -> str:
+    return _NEGATED_PHRASE_RE.sub(" ", text)
+
+
+def _extractive_summary(clinical_text, max_sentences=3) -> str:
+    """
+    First few sentences of the clinical report, used in place of the LLM summary.
+    """
+    text = " ".join((clinical_text or "").split())
+    if not text:
+        return ""
+    return " ".join(_SENTENCE_RE.split(text)[:max_sentences])
+
+
+def parse_birads(radiology_text):
+    """
+    Return the set of BI-RADS categories mentioned in the report.
+    """
+    return {int(m) for m in _BIRADS_RE.findall(radiology_text or "")}
+
+
+def parse_laterality(radiology_text):
+    sides = {m.lower() for m in _LATERALITY_RE.findall(radiology_text or "")}
+    if "bilateral" in sides or {"left", "right"} <= sides:
+        return "Bilateral"
+    if sides:
+        return sides.pop().capitalize()
+    return None
+
+
+def urgency_hints(radiology_text):
+    """
+    Cheap signals used to order reports before extraction: the highest BI-RADS
+    category mentioned, whether non-negated suspicious language appears, and
+    whether the report is tagged urgent.
+    """
+    text = radiology_text or ""
+    categories = parse_birads(text)
+    return {
+        'birads'   : max(categories) if categories else None,
+        'critical' : bool(_CRITICAL_RE.search(_strip_negated(text))),
+        'urgent'   : bool(_URGENT_TAG_RE.search(_strip_negated(text)))
+    }
+
+
+def rule_based_findings(radiology_text, clinical_text=""):
+    """
+    Deterministic extraction for clear-cut reports.
+
+    Returns a dict with the parsed BI-RADS category, laterality, a confidence
+    score in [0, 1] and the findings in the same shape extract_findings returns.
+    Findings is None when the report is too ambiguous to call locally.
+    """
+    text = radiology_text or ""
+    categories = parse_birads(text)
+    laterality = parse_laterality(text)
+    result = {
+        'birads'    : None,
+        'laterality': laterality,
+        'confidence': 0.0,
+        'findings'  : None
+    }
+
+    # No category or conflicting categories: leave it to the LLM
+    if len(categories) != 1:
+        return result
+    birads = categories.pop()
+    result['birads'] = birads
+
+    positive_text = _strip_negated(text)
+    has_critical = bool(_CRITICAL_RE.search(positive_text))
+    has_incidental = bool(_INCIDENTAL_RE.search(positive_text))
+    has_normal = bool(_NORMAL_IMPRESSION_RE.search(text))
+
+    if birads in (1, 2):
+        # Critical wording in a benign-category report is a contradiction for the LLM
+        if has_critical:
+            return result
+        critical, follow_up = 'No', 'No'
+        incidental = 'Yes' if birads == 2 or has_incidental else 'No'
+        confidence = 0.95 if has_normal or birads == 2 else 0.9
+    elif birads in (5, 6):
+        critical, follow_up = 'Yes', 'Yes'
+        incidental = 'Yes' if has_incidental else 'No'
+        confidence = 0.95 if has_critical else 0.9
+    else:
+        # BI-RADS 0, 3 and 4 need judgement the rules can't provide
+        result['confidence'] = 0.5
+        return result
+
+    result['confidence'] = confidence
+    result['findings'] = {
+        'critical_findings'  : critical,
+        'incidental_findings': incidental,
+        'mammogram_score'    : str(birads),
+        'follow_up'          : follow_up,
+        'risk_level'         : 'High' if critical == 'Yes' else ('Medium' if incidental == 'Yes' else 'Low'),
+        'summary'            : _extractive_summary(clinical_text),
+        'extraction_method'  : 'rules'
+    }
+    return result
+
+
+def agreement_report(merged_df, stored_df, threshold=RULE_CONFIDENCE_THRESHOLD):
+    """
+    Compare the rule extractor against stored LLM findings.
+
+    merged_df holds empi_id, timestamp, RADIO_REPORT_TEXT and CLINICAL_REPORT_TEXT
+    (as built by merge_closest_by_timestamp); stored_df holds stored findings with
+    their extraction_method, as returned by load_llm_findings. Only rows the LLM
+    produced are compared, never ones the fast path wrote itself.
+    Returns counts of LLM calls the fast path would remove and per-field agreement.
+    """
+    fields = ['critical_findings', 'incidental_findings', 'mammogram_score', 'follow_up']
+    report = {
+        'total': 0,
+        'fast_path': 0,
+        'fast_path_rate': 0.0,
+        'agreement': {f: 0.0 for f in fields},
+        'disagreements': []
+    }
+    if stored_df is not None and 'extraction_method' in stored_df.columns:
+        stored_df = stored_df[stored_df['extraction_method'] == 'llm']
+    else:
+        stored_df = None
+    if merged_df is None or merged_df.empty or stored_df is None or stored_df.empty:
+        return report
+
+    left = merged_df[['empi_id', 'timestamp', 'RADIO_REPORT_TEXT', 'CLINICAL_REPORT_TEXT']].copy()
+    right = stored_df[['empi_id', 'timestamp'] + fields].copy()
+    left['timestamp'] = canonical_ts(left['timestamp'])
+    right['timestamp'] = canonical_ts(right['timestamp'])
+    joined = left.merge(right, on=['empi_id', 'timestamp'], how='inner')
+
+    report['total'] = len(joined)
+    matches = {f: 0 for f in fields}
+    for row in joined.itertuples(index=False):
+        rule = rule_based_findings(row.RADIO_REPORT_TEXT, row.CLINICAL_REPORT_TEXT)
+        if rule['findings'] is None or rule['confidence'] < threshold:
+            continue
+        report['fast_path'] += 1
+        for f in fields:
+            llm_value = str(getattr(row, f) or '').strip().lower()
+            if rule['findings'][f].strip().lower() == llm_value:
+                matches[f] += 1
+            else:
+                report['disagreements'].append({
+                    'empi_id': row.empi_id,
+                    'timestamp': row.timestamp,
+                    'field': f,
+                    'rule': rule['findings'][f],
+                    'llm': getattr(row, f)
+                })
+
+    if report['total']:
+        report['fast_path_rate'] = report['fast_path'] / report['total']
+    if report['fast_path']:
+        report['agreement'] = {f: matches[f] / report['fast_path'] for f in fields}
+    return report
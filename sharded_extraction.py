@@ -0,0 +1,185 @@
+#sharded_extraction.py
+# Sharded extraction for large backfills. Pending reports are split by a
+# stable hash of empi_id into N shards; each shard runs in its own process
+# (or on its own host, given a shared stage directory) and appends results to
+# its own staging JSONL file, never touching SQLite. A single merge step then
+# bulk-loads every staged result into findings.
+#
+#   python sharded_extraction.py plan  --shards 8 --stage-dir stage   (reads Snowflake once)
+#   python sharded_extraction.py shard --shards 8 --index 3 --stage-dir stage
+#   python sharded_extraction.py merge --stage-dir stage
+#   python sharded_extraction.py run   --shards 8 --stage-dir stage   (all of the above locally)
+#
+# Shards are restartable on their own: keys already in a shard's staging file
+# are skipped, and a partially written last line is cut off before appending.
+# Merging twice is harmless since stored keys are skipped.
+import argparse
+import hashlib
+import multiprocessing
+import os
+import sys
+import pandas as pd
+from batch_extraction import read_jsonl, write_jsonl, request_key, split_key
+from data_storage import store_data_sql, stored_keys
+from utils import canonical_ts
+
+MERGE_BATCH_SIZE = 1000
+
+
+def shard_of(empi_id, num_shards):
+    """
+    Stable across processes and hosts (unlike hash(), which is salted per process).
+    """
+    digest = hashlib.md5(str(empi_id).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+def _input_path(stage_dir, index, num_shards):
+    return os.path.join(stage_dir, f"input-{index:03d}-of-{num_shards:03d}.jsonl")
+
+
+def _staging_path(stage_dir, index, num_shards):
+    return os.path.join(stage_dir, f"staged-{index:03d}-of-{num_shards:03d}.jsonl")
+
+
+def plan_shards(reports_df, num_shards, stage_dir, db_name="findings_db.sqlite"):
+    """
+    Write one input file per shard with the reports (empi_id, timestamp,
+    RADIO_REPORT_TEXT, CLINICAL_REPORT_TEXT) that have no stored findings yet.
+    Returns the number of pending reports per shard.
+    """
+    os.makedirs(stage_dir, exist_ok=True)
+    reports_df = reports_df.copy()
+    reports_df["timestamp"] = canonical_ts(reports_df["timestamp"])
+    done = {request_key(e, t) for e, t in stored_keys(db_name)}
+
+    shards = [[] for _ in range(num_shards)]
+    for row in reports_df.itertuples(index=False):
+        key = request_key(row.empi_id, row.timestamp)
+        if key in done:
+            continue
+        shards[shard_of(row.empi_id, num_shards)].append({
+            "key": key,
+            "radiology_text": row.RADIO_REPORT_TEXT,
+            "clinical_text": getattr(row, "CLINICAL_REPORT_TEXT", "") or ""
+        })
+    for index, rows in enumerate(shards):
+        write_jsonl(rows, _input_path(stage_dir, index, num_shards))
+    return [len(rows) for rows in shards]
+
+
+def run_shard(index, num_shards, stage_dir, extract_fn=None, flush_every=50):
+    """
+    Extract every report in this shard's input file that isn't staged yet,
+    appending results to the shard's staging file. Returns the number extracted.
+    """
+    if extract_fn is None:
+        from text_analysis import extract_findings as extract_fn
+
+    staging_path = _staging_path(stage_dir, index, num_shards)
+    staged = {row["key"] for row in read_jsonl(staging_path) if "key" in row}
+    pending = [row for row in read_jsonl(_input_path(stage_dir, index, num_shards)) if row["key"] not in staged]
+    print(f"Shard {index}/{num_shards}: {len(staged)} staged, {len(pending)} pending")
+
+    # Appended in small batches so a killed shard loses at most flush_every results
+    buffered = []
+    for row in pending:
+        findings = extract_fn(radiology_text=row["radiology_text"], clinical_text=row["clinical_text"])
+        buffered.append({**row, "findings": findings})
+        if len(buffered) >= flush_every:
+            write_jsonl(buffered, staging_path, mode="a")
+            buffered = []
+    if buffered:
+        write_jsonl(buffered, staging_path, mode="a")
+    return len(pending)
+
+
+def merge_shards(stage_dir, db_name="findings_db.sqlite", batch_size=MERGE_BATCH_SIZE):
+    """
+    Bulk-load staged results from every shard into findings, skipping keys
+    that are already stored. Returns the number of findings stored.
+    """
+    done = {request_key(e, t) for e, t in stored_keys(db_name)}
+    staging_files = sorted(f for f in os.listdir(stage_dir) if f.startswith("staged-"))
+
+    batch, stored = [], 0
+    for name in staging_files:
+        for row in read_jsonl(os.path.join(stage_dir, name)):
+            key = row.get("key")
+            if not key or key in done or "findings" not in row:
+                continue
+            done.add(key)
+            empi_id, timestamp = split_key(key)
+            batch.append({
+                "empi_id": empi_id,
+                "timestamp": timestamp,
+                "radiology_text": row.get("radiology_text"),
+                "clinical_text": row.get("clinical_text"),
+                **row["findings"]
+            })
+            if len(batch) >= batch_size:
+                store_data_sql(batch, db_name=db_name)
+                stored += len(batch)
+                batch = []
+    if batch:
+        store_data_sql(batch, db_name=db_name)
+        stored += len(batch)
+    print(f"Merged {stored} findings from {len(staging_files)} shards")
+    return stored
+
+
+def _run_shard_process(args):
+    index, num_shards, stage_dir = args
+    return run_shard(index, num_shards, stage_dir)
+
+
+def run_sharded_extraction(reports_df, num_shards, stage_dir, db_name="findings_db.sqlite", processes=None):
+    """
+    Plan, run every shard in a local process pool and merge.
+    Returns the number of findings stored.
+    """
+    plan_shards(reports_df, num_shards, stage_dir, db_name=db_name)
+    # spawn: workers start clean instead of inheriting open SQLite connections
+    with multiprocessing.get_context("spawn").Pool(processes or min(num_shards, os.cpu_count() or 1)) as pool:
+        pool.map(_run_shard_process, [(i, num_shards, stage_dir) for i in range(num_shards)])
+    return merge_shards(stage_dir, db_name=db_name)
+
+
+def _fetch_pending_reports():
+    from data_retrieval import get_snowflake_data
+    from query_builder import nearest_clinical_query
+    sql, params = nearest_clinical_query("snowflake")
+    df = get_snowflake_data(query=sql, params=params or None)
+    if df is None or df.empty:
+        return pd.DataFrame(columns=["empi_id", "timestamp", "RADIO_REPORT_TEXT", "CLINICAL_REPORT_TEXT"])
+    df["empi_id"] = df["EMPI_ID"]
+    df["timestamp"] = df["TIMESTAMP"]
+    df["CLINICAL_REPORT_TEXT"] = df["CLINICAL_REPORT_TEXT"].fillna("")
+    return df[["empi_id", "timestamp", "RADIO_REPORT_TEXT", "CLINICAL_REPORT_TEXT"]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sharded findings extraction")
+    parser.add_argument("command", choices=["plan", "shard", "merge", "run"])
+    parser.add_argument("--shards", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--index", type=int, help="shard to run (shard command)")
+    parser.add_argument("--stage-dir", default="stage")
+    parser.add_argument("--db", default="findings_db.sqlite")
+    parser.add_argument("--processes", type=int)
+    args = parser.parse_args(argv)
+
+    if args.command == "plan":
+        print("Pending per shard:", plan_shards(_fetch_pending_reports(), args.shards, args.stage_dir, args.db))
+    elif args.command == "shard":
+        if args.index is None or not 0 <= args.index < args.shards:
+            parser.error("--index must be between 0 and --shards - 1")
+        run_shard(args.index, args.shards, args.stage_dir)
+    elif args.command == "merge":
+        merge_shards(args.stage_dir, args.db)
+    else:
+        run_sharded_extraction(_fetch_pending_reports(), args.shards, args.stage_dir, args.db, args.processes)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,17 @@
 #streamlit_app.py
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 from data_retrieval import get_snowflake_data
-from text_analysis import extract_findings, configure_gemini
-from data_storage import store_data_sql, load_data_sql, init_db, reset_db, retry_failed_extractions
+from text_analysis import extract_findings
+from data_storage import store_data_sql, load_data_sql, init_db, reset_db, retry_failed_extractions, findings_version, load_summaries, \
+    stored_keys, archive_old_findings, ensure_patient_summary, load_worklist, findings_date_bounds
 from utils import canonical_ts
+from query_builder import nearest_clinical_query
+from text_store import migrate_inline_summaries
+from extraction_scheduler import ExtractionScheduler, latency_summary, FAST_LANE, CRITICAL_SCORE
 import sqlite3
 import datetime
+import os
 import io
 
 st.set_page_config(
@@ -47,29 +51,6 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
-def risk_badge(level):
-    color = {
-        "Low": "#28a745",
-        "Medium": "#ffc107",
-        "High": "#dc3545"
-    }.get(level, "#6c757d")
-
-    return f'''
-    <span style="
-        display: inline-block;
-        color: white;
-        background-color: {color};
-        padding: 4px 10px;
-        border-radius: 6px;
-        min-width: 80px;
-        text-align: center;
-        font-weight: bold;
-    ">
-        {level}
-    </span>
-    '''
-
-
 def add_custom_css():
     st.markdown("""<style>
     .highlight { background-color: #ffeb3b; padding: 2px 0px; }
@@ -108,43 +89,68 @@ def add_custom_css():
 
 
 add_custom_css()
-init_db()
-configure_gemini()
+
+
+# Database setup runs once per process, not on every rerun. The Gemini SDK is
+# configured by its backend on the first extraction.
+@st.cache_resource
+def initialize_app():
+    init_db()
+    migrate_inline_summaries()
+    ensure_patient_summary()
+    return True
+
+
+# Retention: old findings move to the archive at startup and then on the first
+# rerun after each interval, so a long-running server keeps archiving
+ARCHIVE_INTERVAL_HOURS = float(os.getenv("FINDINGS_ARCHIVE_INTERVAL_HOURS", 24))
+
+
+@st.cache_resource(ttl=datetime.timedelta(hours=ARCHIVE_INTERVAL_HOURS))
+def archive_findings():
+    return archive_old_findings()
+
+
+initialize_app()
+archive_findings()
 
 # Sidebar dev tools
 if st.sidebar.button("Reset DB"):
     reset_db()
+    initialize_app.clear()
+    archive_findings.clear()
     st.sidebar.success("Database reset. Refresh to reprocess reports.")
     st.stop()
 
-def get_radio_for_retry(empi_id, timestamp):
-    return get_snowflake_data(
-        query=f"""
-            SELECT RADIO_REPORT_TEXT
-            FROM radio_reports
-            WHERE EMPI_ID = '{empi_id}'
-              AND TO_CHAR(TIMESTAMP, 'YYYY-MM-DD HH24:MI:SS') = '{timestamp}'
-        """
-    )
-
-def get_clinical_for_retry(empi_id, timestamp):
-    df = get_snowflake_data(
-        query=f"""
-            SELECT CLINICAL_REPORT_TEXT
-            FROM clinical_reports
-            WHERE EMPI_ID = '{empi_id}'
-            ORDER BY ABS(strftime('%s', '{timestamp}') - strftime('%s', TIMESTAMP)) ASC
-            LIMIT 1
-        """
-    )
-    return df if isinstance(df, pd.DataFrame) else pd.DataFrame()
+# Radiology reports paired with their nearest clinical report, matched in Snowflake
+def fetch_report_pairs(keys=None, empi_ids=None):
+    sql, params = nearest_clinical_query("snowflake", keys=keys, empi_ids=empi_ids)
+    df = get_snowflake_data(query=sql, params=params or None)
+    if df is None or df.empty:
+        return pd.DataFrame(columns=["empi_id", "timestamp", "RADIO_REPORT_TEXT", "CLINICAL_REPORT_TEXT"])
+    df["empi_id"] = df["EMPI_ID"]
+    df["timestamp"] = canonical_ts(df["TIMESTAMP"])
+    df["CLINICAL_REPORT_TEXT"] = df["CLINICAL_REPORT_TEXT"].fillna("")
+    return df[["empi_id", "timestamp", "RADIO_REPORT_TEXT", "CLINICAL_REPORT_TEXT"]]
+
+RETRY_KEYS_PER_QUERY = 500
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", 4))
+STORE_BATCH_SIZE = 50
+
+def get_texts_for_retry(keys_df):
+    # One set-based query per chunk of failed keys instead of two per record
+    keys = list(keys_df[["empi_id", "timestamp"]].itertuples(index=False, name=None))
+    chunks = [fetch_report_pairs(keys=keys[i:i + RETRY_KEYS_PER_QUERY])
+              for i in range(0, len(keys), RETRY_KEYS_PER_QUERY)]
+    return pd.concat(chunks, ignore_index=True)
 
 
 if st.sidebar.button("Re-run failed LLM findings"):
+    retry_progress = st.sidebar.progress(0.0, text="Reprocessing failed records...")
     updated = retry_failed_extractions(
         extract_fn=extract_findings,
-        get_radio_fn=get_radio_for_retry,
-        get_clinical_fn=get_clinical_for_retry
+        get_texts_fn=get_texts_for_retry,
+        progress_fn=lambda done, total: retry_progress.progress(done / total, text=f"Reprocessed {done}/{total}")
     )
     if updated:
         st.sidebar.success(f"✅ Reprocessed {updated} failed records.")
@@ -154,64 +160,19 @@ if st.sidebar.button("Re-run failed LLM findings"):
 
 
 @st.cache_data
-def load_radiology_data():
-    return get_snowflake_data(
-        query="SELECT EMPI_ID, RADIO_REPORT_TEXT, TIMESTAMP FROM radio_reports"
-    )
-
-@st.cache_data
-def load_clinical_data():
-    return get_snowflake_data(
-        query="SELECT EMPI_ID, CLINICAL_REPORT_TEXT, TIMESTAMP FROM clinical_reports"
-    )
-
-# Helper to match each radiology report with the closest clinical report
-def merge_closest_by_timestamp(radio_df, clinical_df):
-    merged_rows = []
-    for _, rad_row in radio_df.iterrows():
-        empi_id = rad_row["empi_id"]
-        ts_rad = pd.to_datetime(rad_row["timestamp"])
-
-        subset = clinical_df[clinical_df["empi_id"] == empi_id].copy()
-        if not subset.empty:
-            subset["time_diff"] = (pd.to_datetime(subset["timestamp"]) - ts_rad).abs()
-            best_match = subset.sort_values("time_diff").iloc[0]
-            clinical_text = best_match["CLINICAL_REPORT_TEXT"]
-        else:
-            clinical_text = ""
-
-        merged_rows.append({
-            "empi_id": empi_id,
-            "timestamp": rad_row["timestamp"],
-            "RADIO_REPORT_TEXT": rad_row["RADIO_REPORT_TEXT"],
-            "CLINICAL_REPORT_TEXT": clinical_text
-        })
-
-    return pd.DataFrame(merged_rows)
+def load_report_pairs():
+    return fetch_report_pairs()
 
 # Run only once
 if 'processed' not in st.session_state:
-    # Load and normalize data
-    radio_df = load_radiology_data()
-    if radio_df is None or radio_df.empty:
+    # Each radiology report arrives already paired with its closest clinical report
+    merged_df = load_report_pairs()
+    if merged_df.empty:
         st.error("Failed to load radiology data from Snowflake. Please check your .env configuration and Snowflake connection.")
         st.stop()
 
-    clinical_df = load_clinical_data()
-    if clinical_df is None or clinical_df.empty:
-        st.error("Failed to load clinical data from Snowflake. Please check your .env configuration and Snowflake connection.")
-        st.stop()
-
-    radio_df["timestamp"] = canonical_ts(radio_df["TIMESTAMP"])
-    clinical_df["timestamp"] = canonical_ts(clinical_df["TIMESTAMP"])
-    radio_df["empi_id"] = radio_df["EMPI_ID"]
-    clinical_df["empi_id"] = clinical_df["EMPI_ID"]
-
-    # Match each radiology report with the closest clinical report
-    merged_df = merge_closest_by_timestamp(radio_df, clinical_df)
-
-    # Load existing stored findings
-    stored_df = load_data_sql()
+    # Keys of findings already stored, archived history included
+    stored_df = pd.DataFrame(list(stored_keys()), columns=["empi_id", "timestamp"])
     if not stored_df.empty:
         stored_df["timestamp"] = canonical_ts(stored_df["timestamp"])
 
@@ -227,48 +188,187 @@ if 'processed' not in st.session_state:
         )
         new_reports = new_reports[new_reports["_merge"] == "left_only"].drop(columns="_merge")
 
-    # Run Gemini only on new reports
+    # Run Gemini only on new reports, most urgent first
     if not new_reports.empty:
-        extracted_rows = []
-        for _, row in new_reports.iterrows():
+        scheduler = ExtractionScheduler(max_workers=EXTRACTION_WORKERS)
+        for row in new_reports.to_dict("records"):
+            scheduler.submit((row["empi_id"], row["timestamp"]), row,
+                             radiology_text=row["RADIO_REPORT_TEXT"], timestamp=row["timestamp"])
+
+        def extract_row(row):
             findings = extract_findings(
                 radiology_text=row["RADIO_REPORT_TEXT"],
                 clinical_text=row.get("CLINICAL_REPORT_TEXT", "")
             )
-            extracted_rows.append({
+            return {
                 "empi_id": row["empi_id"],
                 "timestamp": row["timestamp"],
+                "radiology_text": row["RADIO_REPORT_TEXT"],
+                "clinical_text": row.get("CLINICAL_REPORT_TEXT", ""),
                 **findings
-            })
-        store_data_sql(extracted_rows)
-        st.success(f"Extracted and stored {len(extracted_rows)} new findings.")
+            }
+
+        # Likely-critical results are stored right away; routine ones in batches
+        pending_rows = []
+        def store_result(key, extracted, entry):
+            pending_rows.append(extracted)
+            if (entry["lane"] == FAST_LANE or entry["score"] >= CRITICAL_SCORE
+                    or len(pending_rows) >= STORE_BATCH_SIZE):
+                store_data_sql(pending_rows)
+                pending_rows.clear()
+
+        records = scheduler.run(extract_row, on_result=store_result)
+        if pending_rows:
+            store_data_sql(pending_rows)
+        latency = latency_summary(records)
+        st.success(f"Extracted and stored {sum(r['ok'] for r in records)} new findings.")
+        if latency.get("critical", {}).get("over_target"):
+            st.warning(f"{latency['critical']['over_target']} likely-critical reports took longer than "
+                       f"{latency['critical']['target_seconds']:.0f}s to store.")
     else:
         st.info("✅ All radiology reports already processed.")
 
     st.session_state.processed = True
 
 
-df_display = load_data_sql()
+RISK_BADGES = {"Low": "🟢 Low", "Medium": "🟡 Medium", "High": "🔴 High"}
+
+
+# ------------- Memoized data views ------------------
+# Keyed by the findings version and the filter state, shared by all sessions,
+# so paging or rerunning a fragment never recomputes filters, charts or exports.
+# Results are read-only; copy before modifying.
+@st.cache_resource(max_entries=16)
+def load_display_frame(version, date_range):
+    _, include_archive = version
+    # With archived history on, only the monthly partitions overlapping the
+    # selected dates are read; the hot table alone needs no routing
+    if include_archive and len(date_range) == 2 and None not in date_range:
+        return load_data_sql(start=date_range[0], end=date_range[1])
+    return load_data_sql(include_archive=include_archive)
+
+@st.cache_resource(max_entries=64)
+def filter_findings(version, filter_key):
+    selected_empi, date_range, selected_critical, selected_followup, selected_risk, patient_search = filter_key
+    filtered_df = load_display_frame(version, date_range)
+
+    if selected_empi != "All":
+        filtered_df = filtered_df[filtered_df['empi_id'] == selected_empi]
+
+    if len(date_range) == 2 and None not in date_range:
+        start_date, end_date = date_range
+        filtered_df = filtered_df[
+            (filtered_df['timestamp'].dt.date >= start_date) &
+            (filtered_df['timestamp'].dt.date <= end_date)
+        ]
+
+    if selected_critical != "All":
+        filtered_df = filtered_df[filtered_df['critical_findings'] == selected_critical]
+
+    if selected_followup != "All":
+        filtered_df = filtered_df[filtered_df['follow_up'] == selected_followup]
+
+    if selected_risk != "All":
+        filtered_df = filtered_df[filtered_df['risk_level'] == selected_risk]
+
+    if patient_search:
+        filtered_df = filtered_df[filtered_df['empi_id'].str.contains(patient_search, case=False, regex=False)]
+
+    return filtered_df
+
+@st.cache_resource(max_entries=64)
+def findings_overview(version, filter_key):
+    filtered_df = filter_findings(version, filter_key)
+    counts = {
+        'critical': int((filtered_df['critical_findings'] == 'Yes').sum()),
+        'incidental': int((filtered_df['incidental_findings'] == 'Yes').sum()),
+        'followup': int((filtered_df['follow_up'] == 'Yes').sum()),
+        'total': len(filtered_df)
+    }
+    import plotly.express as px  # deferred: only needed once the chart is built
+
+    fig = px.pie(filtered_df, names='critical_findings', title='Critical Findings Distribution',
+                 color_discrete_sequence=px.colors.qualitative.Set2)
+    return counts, fig
+
+@st.cache_resource(max_entries=16)
+def excel_export(version, filter_key):
+    excel_buffer = io.BytesIO()
+    # Summaries are stored compressed apart from the findings; only the export needs them all
+    export_df = filter_findings(version, filter_key).merge(
+        load_summaries(include_archive=version[1]), on=["empi_id", "timestamp"], how="left"
+    )
+    export_df.to_excel(excel_buffer, index=False)
+    return excel_buffer.getvalue()
+
+
+# The default view is the hot table (recent findings); archived months load on request
+include_archive = st.sidebar.checkbox("Include archived history", value=False)
+version = (findings_version(), include_archive)
+
+# ------------- Risk Worklist ------------------
+# Patients whose latest exam is High risk or needs follow-up, read from the
+# incrementally maintained patient_summary table (covers archived exams too)
+WORKLIST_LIMIT = 200
+
+@st.cache_resource(max_entries=4)
+def worklist_frame(findings_ver):
+    worklist = load_worklist(limit=WORKLIST_LIMIT)
+    return pd.DataFrame({
+        "EMPI ID": worklist["empi_id"].values,
+        "Latest Exam": worklist["latest_timestamp"].values,
+        "Risk Level": worklist["latest_risk_level"].map(RISK_BADGES).fillna(worklist["latest_risk_level"]).values,
+        "Critical": worklist["latest_critical"].values,
+        "Follow-up": worklist["latest_follow_up"].values,
+        "Exams": worklist["exam_count"].values,
+    })
+
+@st.fragment
+def worklist_section(findings_ver):
+    with st.expander("Risk Worklist", expanded=False):
+        worklist = worklist_frame(findings_ver)
+        if worklist.empty:
+            st.info("No patients currently need attention.")
+            return
+        st.caption(f"Most recent {len(worklist)} patients needing attention")
+        table_key = f"worklist_{st.session_state.get('worklist_nonce', 0)}"
+        event = st.dataframe(
+            worklist,
+            key=table_key,
+            on_select="rerun",
+            selection_mode="single-row",
+            hide_index=True,
+            width="stretch",
+            column_config={
+                "Latest Exam": st.column_config.DatetimeColumn(format="YYYY-MM-DD HH:mm:ss"),
+            }
+        )
+        if event.selection.rows:
+            row = worklist.iloc[event.selection.rows[0]]
+            st.session_state.selected_patient = row["EMPI ID"]
+            st.session_state.selected_timestamp = row["Latest Exam"]
+            st.session_state.worklist_nonce = st.session_state.get('worklist_nonce', 0) + 1
+            st.switch_page("pages/patient_detail.py")
+
+
+worklist_section(version[0])
 
 # ------------- Filters ------------------
+# Filters stay in the main script: changing one has to refresh every view below
 st.markdown("### Filters")
 col1, col2, col3, col4, col5 = st.columns(5)
 
-with col1:
-    empi_ids = ["All"] + sorted(df_display['empi_id'].unique())
-    selected_empi = st.selectbox("Select EMPI ID", empi_ids)
-
+# The date range decides which archive months are read, so it comes first
 with col2:
-    df_display['timestamp'] = pd.to_datetime(df_display['timestamp'], errors='coerce')
-    valid_timestamps = df_display['timestamp'].dropna()
+    min_ts, max_ts = findings_date_bounds(include_archive=include_archive)
 
-    if valid_timestamps.empty:
+    if min_ts is None:
         st.warning("⚠️ No valid timestamps available. Skipping date filter.")
         date_range = (None, None)
     else:
         try:
-            min_date = valid_timestamps.min().date()
-            max_date = valid_timestamps.max().date()
+            min_date = min_ts.date()
+            max_date = max_ts.date()
 
             # Ensure both are valid datetime.date objects
             if pd.isna(min_date) or pd.isna(max_date):
@@ -279,6 +379,12 @@ with col2:
             st.error(f"❌ Error setting date range filter: {e}")
             date_range = (None, None)
 
+df_display = load_display_frame(version, tuple(date_range))
+
+with col1:
+    empi_ids = ["All"] + sorted(df_display['empi_id'].unique())
+    selected_empi = st.selectbox("Select EMPI ID", empi_ids)
+
 
 with col3:
     selected_critical = st.selectbox("Critical Findings", ["All", "Yes", "No"])
@@ -291,148 +397,108 @@ with col5:
 
 patient_search = st.text_input("Search Patient ID")
 
-# ------------- Filtering Logic ---------------
-filtered_df = df_display.copy()
-
-if selected_empi != "All":
-    filtered_df = filtered_df[filtered_df['empi_id'] == selected_empi]
-
-if len(date_range) == 2:
-    start_date, end_date = date_range
-    filtered_df = filtered_df[
-        (filtered_df['timestamp'].dt.date >= start_date) &
-        (filtered_df['timestamp'].dt.date <= end_date)
-    ]
-
-if selected_critical != "All":
-    filtered_df = filtered_df[filtered_df['critical_findings'] == selected_critical]
-
-if selected_followup != "All":
-    filtered_df = filtered_df[filtered_df['follow_up'] == selected_followup]
-
-if selected_risk != "All":
-    filtered_df = filtered_df[filtered_df['risk_level'] == selected_risk]
-
-if patient_search:
-    filtered_df = filtered_df[filtered_df['empi_id'].str.contains(patient_search, case=False)]
-
-# ------------- Summary Cards ------------------
-st.markdown("### Findings Overview")
-critical_count = (filtered_df['critical_findings'] == 'Yes').sum()
-incidental_count = (filtered_df['incidental_findings'] == 'Yes').sum()
-followup_count = (filtered_df['follow_up'] == 'Yes').sum()
-
-cols = st.columns(4)
-cols[0].markdown(f"""
-<div class='status-card critical'>
-    <div>Critical Findings</div>
-    <h2>{critical_count}</h2>
-</div>
-""", unsafe_allow_html=True)
-
-cols[1].markdown(f"""
-<div class='status-card incidental'>
-    <div>Incidental Findings</div>
-    <h2>{incidental_count}</h2>
-</div>
-""", unsafe_allow_html=True)
-
-cols[2].markdown(f"""
-<div class='status-card followup'>
-    <div>Follow-Up Required</div>
-    <h2>{followup_count}</h2>
-</div>
-""", unsafe_allow_html=True)
-
-cols[3].markdown(f"""
-<div class='status-card not-needed'>
-    <div>No Follow-Up</div>
-    <h2>{len(filtered_df) - followup_count}</h2>
-</div>
-""", unsafe_allow_html=True)
-
-# ------------- Pie Chart ----------------------
-st.markdown("### Findings Distribution")
-fig = px.pie(filtered_df, names='critical_findings', title='Critical Findings Distribution',
-             color_discrete_sequence=px.colors.qualitative.Set2)
-st.plotly_chart(fig, use_container_width=True)
+filter_key = (selected_empi, tuple(date_range), selected_critical, selected_followup, selected_risk, patient_search)
 
-# ------------- Paginated Table ----------------
-st.markdown("### Patient List")
-st.markdown(f"Showing {len(filtered_df)} patients")
 
-ROWS_PER_PAGE = 10
-total_pages = max((len(filtered_df) - 1) // ROWS_PER_PAGE + 1, 1)
-st.session_state.page_num = st.session_state.get("page_num", 1)
+# ------------- Summary Cards & Pie Chart ------------------
+@st.fragment
+def overview_section(version, filter_key):
+    st.markdown("### Findings Overview")
+    counts, fig = findings_overview(version, filter_key)
 
-col1, col2, col3 = st.columns([1, 3, 1])
-with col2:
-    page_input = st.number_input("Page", 1, total_pages, value=st.session_state.page_num, key="page_num_input")
-    if page_input != st.session_state.page_num:
-        st.session_state.page_num = page_input
-        st.rerun()
+    cols = st.columns(4)
+    cols[0].markdown(f"""
+    <div class='status-card critical'>
+        <div>Critical Findings</div>
+        <h2>{counts['critical']}</h2>
+    </div>
+    """, unsafe_allow_html=True)
 
-start_idx = (st.session_state.page_num - 1) * ROWS_PER_PAGE
-end_idx = min(start_idx + ROWS_PER_PAGE, len(filtered_df))
-page_data = filtered_df.iloc[start_idx:end_idx]
+    cols[1].markdown(f"""
+    <div class='status-card incidental'>
+        <div>Incidental Findings</div>
+        <h2>{counts['incidental']}</h2>
+    </div>
+    """, unsafe_allow_html=True)
 
-if not page_data.empty:
-    st.markdown("""
-    <style>
-    .table-header {
-        display: grid;
-        grid-template-columns: 2fr 2fr 1.5fr 1.5fr 1.5fr 1.5fr 1fr;
-        font-weight: bold;
-        margin-top: 1rem;
-        margin-bottom: 0.5rem;
-    }
-    .table-row {
-        display: grid;
-        grid-template-columns: 2fr 2fr 1.5fr 1.5fr 1.5fr 1.5fr 1fr;
-        align-items: center;
-        padding: 0.3rem 0;
-        border-bottom: 1px solid #eee;
-    }
-    </style>
+    cols[2].markdown(f"""
+    <div class='status-card followup'>
+        <div>Follow-Up Required</div>
+        <h2>{counts['followup']}</h2>
+    </div>
     """, unsafe_allow_html=True)
 
-    st.markdown("""
-    <div class="table-header">
-        <div>EMPI ID</div>
-        <div>Timestamp</div>
-        <div>Critical</div>
-        <div>Incidental</div>
-        <div>Score</div>
-        <div>Risk Level</div>
-        <div>Action</div>
+    cols[3].markdown(f"""
+    <div class='status-card not-needed'>
+        <div>No Follow-Up</div>
+        <h2>{counts['total'] - counts['followup']}</h2>
     </div>
     """, unsafe_allow_html=True)
 
-    for i, row in page_data.reset_index(drop=True).iterrows():
-        with st.container():
-            cols = st.columns([2, 2, 1.5, 1.5, 1.5, 1.5, 1])
-            cols[0].write(row["empi_id"])
-            cols[1].write(str(row["timestamp"]))
-            cols[2].markdown("🔴 Yes" if row["critical_findings"] == "Yes" else "❌ No")
-            cols[3].markdown("🟠 Yes" if row["incidental_findings"] == "Yes" else "❌ No")
-            cols[4].write(row["mammogram_score"])
-            cols[5].markdown(risk_badge(row["risk_level"]), unsafe_allow_html=True)
-            with cols[6]:
-                if st.button("View", key=f"view_{i}"):
-                    st.session_state.selected_patient = row["empi_id"]
-                    st.session_state.selected_timestamp = row["timestamp"]
-                    st.switch_page("pages/patient_detail.py")
-else:
-    st.warning("No data available.")
+    st.markdown("### Findings Distribution")
+    st.plotly_chart(fig, width="stretch")
+
+
+# ------------- Patient Table ----------------
+
+@st.cache_resource(max_entries=16)
+def patient_table_frame(version, filter_key):
+    filtered_df = filter_findings(version, filter_key)
+    return pd.DataFrame({
+        "EMPI ID": filtered_df["empi_id"].values,
+        "Timestamp": filtered_df["timestamp"].values,
+        "Critical": filtered_df["critical_findings"].map({"Yes": "🔴 Yes"}).fillna("❌ No").values,
+        "Incidental": filtered_df["incidental_findings"].map({"Yes": "🟠 Yes"}).fillna("❌ No").values,
+        "Score": filtered_df["mammogram_score"].values,
+        "Risk Level": filtered_df["risk_level"].map(RISK_BADGES).fillna(filtered_df["risk_level"]).values,
+    })
+
+@st.fragment
+def patient_table_section(version, filter_key):
+    filtered_df = filter_findings(version, filter_key)
+    st.markdown("### Patient List")
+    st.markdown(f"Showing {len(filtered_df)} patients")
+
+    if filtered_df.empty:
+        st.warning("No data available.")
+        return
+
+    # One virtualized grid for the whole result; selecting a row opens the detail page.
+    # The key changes after each selection so the table comes back unselected.
+    table_key = f"patient_table_{st.session_state.get('patient_table_nonce', 0)}"
+    event = st.dataframe(
+        patient_table_frame(version, filter_key),
+        key=table_key,
+        on_select="rerun",
+        selection_mode="single-row",
+        hide_index=True,
+        width="stretch",
+        height=420,
+        column_config={
+            "Timestamp": st.column_config.DatetimeColumn(format="YYYY-MM-DD HH:mm:ss"),
+        }
+    )
+    if event.selection.rows:
+        row = filtered_df.iloc[event.selection.rows[0]]
+        st.session_state.selected_patient = row["empi_id"]
+        st.session_state.selected_timestamp = row["timestamp"]
+        st.session_state.patient_table_nonce = st.session_state.get('patient_table_nonce', 0) + 1
+        st.switch_page("pages/patient_detail.py")
+
 
 # --- Excel download button ---
-if not filtered_df.empty:
-    excel_buffer = io.BytesIO()
-    filtered_df.to_excel(excel_buffer, index=False)
-    excel_buffer.seek(0)
+@st.fragment
+def export_section(version, filter_key):
+    if filter_findings(version, filter_key).empty:
+        return
     st.download_button(
         label="⬇️ Download Full Table as Excel",
-        data=excel_buffer,
+        data=excel_export(version, filter_key),
         file_name="patient_reports.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
\ No newline at end of file
+    )
+
+
+overview_section(version, filter_key)
+patient_table_section(version, filter_key)
+export_section(version, filter_key)
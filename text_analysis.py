@@ -1,15 +1,38 @@
 #text_analysis.py
-import google.generativeai as genai
 import json
 import re
-import os
-from dotenv import load_dotenv
+from collections import deque
+from rule_extraction import rule_based_findings, RULE_CONFIDENCE_THRESHOLD
+from prompt_compaction import compact_prompt_inputs
+from llm_backends import get_backend
 
-load_dotenv()
+# Bump PROMPT_VERSION whenever the template wording changes
+PROMPT_VERSION = "2"
+PROMPT_TEMPLATE = """
+Radiology Report:
+{radiology_text}
 
+Clinical Report (Patient History):
+{clinical_text}
+
+Based on the radiology report and the patient’s clinical report, extract and return the following in JSON format:
+
+* Critical Findings: Yes/No
+* Incidental Findings: Yes/No
+* Mammogram Score: [Numeric Score or Category]
+* Follow Up Required: Yes/No
+* Assign a patient risk level (based on findings and history): Low, Medium, or High
+* Provide a brief 2-3 sentence summary of the patient’s medical history based on patient’s clinical report.
+
+Return ONLY the following keys in a JSON object:
+"Critical Findings", "Incidental Findings", "Mammogram Score", "Follow Up Required", "Risk Level", and "Summary".
+
+Do not include commentary or code block formatting.
+"""
+
+# Token estimates for the most recent prompts (before/after compaction)
+PROMPT_STATS = deque(maxlen=1000)
 
-def configure_gemini(api_key=None):
-    genai.configure(api_key=api_key or os.getenv("GEMINI_API_KEY"))
 
 def _remove_fences(text: str) -> str:
     """
@@ -21,54 +44,61 @@ def _remove_fences(text: str) -> str:
     fenced = re.match(r"^```[\w]*\s*(.*?)\s*```$", text, re.S)
     return fenced.group(1).strip() if fenced else text
 
-def extract_findings(radiology_text, clinical_text):
-    prompt = f"""
-    Radiology Report:
-    {radiology_text}
+def _fast_path(radiology_text, clinical_text):
+    rule = rule_based_findings(radiology_text, clinical_text)
+    if rule['findings'] is not None and rule['confidence'] >= RULE_CONFIDENCE_THRESHOLD:
+        print(f"Rule fast path (BI-RADS {rule['birads']}, confidence {rule['confidence']:.2f})")
+        return rule['findings']
+    return None
 
-    Clinical Report (Patient History):
-    {clinical_text}
+def build_prompt(radiology_text, clinical_text):
+    radiology_text, clinical_text, stats = compact_prompt_inputs(radiology_text, clinical_text)
+    PROMPT_STATS.append({**stats, 'prompt_version': PROMPT_VERSION})
+    print(f"Prompt tokens: {stats['tokens_after']} (saved {stats['tokens_saved']})")
+    return PROMPT_TEMPLATE.format(radiology_text=radiology_text, clinical_text=clinical_text)
 
-    Based on the radiology report and the patient’s clinical report, extract and return the following in JSON format:
+def parse_findings(raw):
+    """
+    Turn raw model output into the findings dict stored in the database.
+    Raises on malformed output.
+    """
+    data = json.loads(_remove_fences(raw))
+    return {
+        'critical_findings'  : data.get('Critical Findings', 'No'),
+        'incidental_findings': data.get('Incidental Findings', 'No'),
+        'mammogram_score'    : data.get('Mammogram Score', 'Not Available'),
+        'follow_up'          : data.get('Follow Up Required', 'No'),
+        'risk_level'         : data.get('Risk Level', 'Low'),
+        'summary'            : data.get('Summary', ''),
+        'extraction_method'  : 'llm'
+    }
 
-    * Critical Findings: Yes/No
-    * Incidental Findings: Yes/No
-    * Mammogram Score: [Numeric Score or Category]
-    * Follow Up Required: Yes/No
-    * Assign a patient risk level (based on findings and history): Low, Medium, or High
-    * Provide a brief 2-3 sentence summary of the patient’s medical history based on patient’s clinical report.
+def failed_findings():
+    return {
+        'critical_findings'  : 'None',
+        'incidental_findings': 'None',
+        'mammogram_score'    : 'None',
+        'follow_up'          : 'None',
+        'risk_level'         : 'None',
+        'summary'            : '',
+        'extraction_method'  : None
+    }
 
-    Return ONLY the following keys in a JSON object:
-    "Critical Findings", "Incidental Findings", "Mammogram Score", "Follow Up Required", "Risk Level", and "Summary".
+def extract_findings(radiology_text, clinical_text, use_rules=True, backend=None):
+    # Clear-cut reports are answered locally; only ambiguous ones go to Gemini
+    if use_rules:
+        findings = _fast_path(radiology_text, clinical_text)
+        if findings is not None:
+            return findings
 
-    Do not include commentary or code block formatting.
-    """
+    prompt = build_prompt(radiology_text, clinical_text)
 
     try:
-        model = genai.GenerativeModel("gemini-1.5-flash")
-        resp = model.generate_content(prompt)
-        raw = resp.text
-        print("Gemini raw output:", raw)
-
-        clean = _remove_fences(raw)
-        data = json.loads(clean)
-
-        return {
-            'critical_findings'  : data.get('Critical Findings', 'No'),
-            'incidental_findings': data.get('Incidental Findings', 'No'),
-            'mammogram_score'    : data.get('Mammogram Score', 'Not Available'),
-            'follow_up'          : data.get('Follow Up Required', 'No'),
-            'risk_level'         : data.get('Risk Level', 'Low'),
-            'summary'            : data.get('Summary', '')
-        }
+        backend = backend or get_backend()
+        raw = backend.generate(prompt)
+        print(f"{backend.name} raw output:", raw)
+
+        return parse_findings(raw)
     except Exception as e:
         print("Error extracting findings:", e)
-        return {
-            'critical_findings'  : 'None',
-            'incidental_findings': 'None',
-            'mammogram_score'    : 'None',
-            'follow_up'          : 'None',
-            'risk_level'         : 'None',
-            'summary'            : ''
-        }
-
+        return failed_findings()
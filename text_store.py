@@ -0,0 +1,234 @@
+#text_store.py
+# Compressed storage for large text (summaries, cached report text). Texts live
+# in a side table keyed by finding id so the findings rows stay narrow, and are
+# only decompressed when a page actually shows them. Report language is very
+# repetitive, so a shared dictionary trained on stored texts does most of the work.
+import os
+import re
+import sqlite3
+import zlib
+from collections import Counter
+
+try:
+    import zstandard
+except ImportError:  # zlib with a preset dictionary is the fallback
+    zstandard = None
+
+TEXT_KINDS = ("summary", "radiology", "clinical")
+DICT_SIZE = 32 * 1024  # zlib only uses the last 32KB of a preset dictionary
+MIN_TRAINING_SAMPLES = 50
+MAX_TRAINING_SAMPLES = 2000
+
+TEXT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS finding_texts (
+    finding_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    codec TEXT NOT NULL,
+    dict_id INTEGER,
+    body BLOB,
+    PRIMARY KEY (finding_id, kind)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS compression_dicts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    codec TEXT NOT NULL,
+    body BLOB NOT NULL
+);
+"""
+
+# (database path, dict_id) -> dictionary bytes, loaded once per process.
+# Ids are only unique within one database, so the path is part of the key.
+_dicts = {}
+
+
+def _db_path(conn):
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    return os.path.abspath(path) if path else f":memory:{id(conn)}"
+
+
+def clear_dictionary_cache():
+    _dicts.clear()
+
+
+def _dictionary(conn, dict_id):
+    if dict_id is None:
+        return None
+    key = (_db_path(conn), dict_id)
+    if key not in _dicts:
+        row = conn.execute("SELECT body FROM compression_dicts WHERE id = ?", (dict_id,)).fetchone()
+        _dicts[key] = bytes(row[0]) if row else None
+    return _dicts[key]
+
+
+def _latest_dictionary(conn):
+    row = conn.execute("SELECT id, codec FROM compression_dicts ORDER BY id DESC LIMIT 1").fetchone()
+    if row is None:
+        return None, None
+    # A zstd dictionary is useless if zstandard went missing since it was trained
+    if row[1] == "zstd" and zstandard is None:
+        return None, None
+    return row[0], row[1]
+
+
+def compress_text(text, codec="zlib", zdict=None):
+    data = (text or "").encode("utf-8")
+    if codec == "zstd":
+        cdict = zstandard.ZstdCompressionDict(zdict) if zdict else None
+        return zstandard.ZstdCompressor(level=9, dict_data=cdict).compress(data)
+    if codec == "zlib":
+        comp = zlib.compressobj(9, zdict=zdict) if zdict else zlib.compressobj(9)
+        return comp.compress(data) + comp.flush()
+    return data
+
+
+def decompress_text(body, codec="zlib", zdict=None):
+    if body is None:
+        return None
+    body = bytes(body)
+    if codec == "zstd":
+        cdict = zstandard.ZstdCompressionDict(zdict) if zdict else None
+        return zstandard.ZstdDecompressor(dict_data=cdict).decompress(body).decode("utf-8")
+    if codec == "zlib":
+        decomp = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+        return (decomp.decompress(body) + decomp.flush()).decode("utf-8")
+    return body.decode("utf-8")
+
+
+def _zlib_dictionary(samples, size=DICT_SIZE):
+    """
+    Frequent word 4-grams across the samples, most frequent last
+    (zlib matches nearer the end of the dictionary more cheaply).
+    """
+    grams = Counter()
+    for text in samples:
+        words = re.findall(r"\S+", text)
+        grams.update(" ".join(words[i:i + 4]) for i in range(len(words) - 3))
+    picked, used = [], 0
+    for gram, count in grams.most_common():
+        if count < 2 or used + len(gram) + 1 > size:
+            break
+        picked.append(gram)
+        used += len(gram) + 1
+    return " ".join(reversed(picked)).encode("utf-8")
+
+
+def train_dictionary(conn, samples=None, kind=None):
+    """
+    Train a dictionary on stored texts (or the given samples) and register it
+    for future writes. Returns the new dict id, or None with too few samples.
+    """
+    if samples is None:
+        sql = "SELECT finding_id, kind, codec, dict_id, body FROM finding_texts"
+        sql += (" WHERE kind = ?" if kind else "") + " ORDER BY finding_id DESC LIMIT ?"
+        rows = conn.execute(sql, ((kind,) if kind else ()) + (MAX_TRAINING_SAMPLES,)).fetchall()
+        samples = [decompress_text(body, codec, _dictionary(conn, dict_id)) for _, _, codec, dict_id, body in rows]
+    samples = [s for s in samples if s]
+    if len(samples) < MIN_TRAINING_SAMPLES:
+        return None
+
+    codec, body = "zlib", None
+    if zstandard is not None:
+        try:
+            encoded = [s.encode("utf-8") for s in samples]
+            body = zstandard.train_dictionary(DICT_SIZE, encoded).as_bytes()
+            codec = "zstd"
+        except Exception as e:
+            print("zstd dictionary training failed, using zlib:", e)
+    if body is None:
+        body = _zlib_dictionary(samples)
+
+    cur = conn.execute("INSERT INTO compression_dicts (codec, body) VALUES (?, ?)", (codec, body))
+    conn.commit()
+    return cur.lastrowid
+
+
+def ensure_dictionary(conn):
+    """
+    Train the first dictionary once enough texts are stored. Texts written
+    before that stay readable as they are. Returns the new dict id or None.
+    """
+    if conn.execute("SELECT 1 FROM compression_dicts LIMIT 1").fetchone():
+        return None
+    stored = conn.execute("SELECT COUNT(*) FROM finding_texts").fetchone()[0]
+    if stored < MIN_TRAINING_SAMPLES:
+        return None
+    return train_dictionary(conn)
+
+
+def put_texts(conn, finding_id, texts):
+    """
+    Store {kind: text} for a finding with the latest dictionary. Caller commits.
+    """
+    dict_id, codec = _latest_dictionary(conn)
+    codec = codec or "zlib"
+    zdict = _dictionary(conn, dict_id)
+    rows = []
+    for kind, text in texts.items():
+        if text is None:
+            continue
+        body = compress_text(text, codec, zdict)
+        # Short texts can come out bigger; keep those as they are
+        if len(body) >= len(text.encode("utf-8")):
+            rows.append((finding_id, kind, "plain", None, text.encode("utf-8")))
+        else:
+            rows.append((finding_id, kind, codec, dict_id, body))
+    conn.executemany("""
+        INSERT OR REPLACE INTO finding_texts (finding_id, kind, codec, dict_id, body)
+        VALUES (?, ?, ?, ?, ?)
+    """, rows)
+
+
+def get_texts(conn, finding_id, kinds=TEXT_KINDS):
+    rows = conn.execute(f"""
+        SELECT kind, codec, dict_id, body FROM finding_texts
+        WHERE finding_id = ? AND kind IN ({", ".join("?" * len(kinds))})
+    """, (finding_id, *kinds)).fetchall()
+    return {kind: decompress_text(body, codec, _dictionary(conn, dict_id)) for kind, codec, dict_id, body in rows}
+
+
+def get_texts_bulk(conn, kind="summary", finding_ids=None):
+    """
+    {finding_id: text} for every stored text of one kind, or only for
+    finding_ids when given (used by exports).
+    """
+    if finding_ids is None:
+        rows = conn.execute(
+            "SELECT finding_id, codec, dict_id, body FROM finding_texts WHERE kind = ?", (kind,)
+        ).fetchall()
+    else:
+        finding_ids, rows = list(finding_ids), []
+        # Chunked to stay under SQLite's bound-parameter limit
+        for i in range(0, len(finding_ids), 500):
+            chunk = finding_ids[i:i + 500]
+            rows += conn.execute(f"""
+                SELECT finding_id, codec, dict_id, body FROM finding_texts
+                WHERE kind = ? AND finding_id IN ({", ".join("?" * len(chunk))})
+            """, (kind, *chunk)).fetchall()
+    return {fid: decompress_text(body, codec, _dictionary(conn, dict_id)) for fid, codec, dict_id, body in rows}
+
+
+def migrate_inline_summaries(db_name="findings_db.sqlite", vacuum=True):
+    """
+    Move summaries still stored inline in findings into the compressed side
+    table, training a dictionary first when there are enough of them.
+    Returns the number of summaries moved.
+    """
+    conn = sqlite3.connect(db_name)
+    try:
+        conn.executescript(TEXT_SCHEMA)
+        rows = conn.execute("""
+            SELECT id, summary FROM findings
+            WHERE summary IS NOT NULL AND summary != ''
+        """).fetchall()
+        if not rows:
+            return 0
+        if _latest_dictionary(conn)[0] is None:
+            train_dictionary(conn, samples=[summary for _, summary in rows])
+        for finding_id, summary in rows:
+            put_texts(conn, finding_id, {"summary": summary})
+        conn.executemany("UPDATE findings SET summary = '' WHERE id = ?", [(fid,) for fid, _ in rows])
+        conn.commit()
+        if vacuum:
+            conn.execute("VACUUM")
+        return len(rows)
+    finally:
+        conn.close()